@@ -3,13 +3,16 @@ Configuration settings for BI Self-Service Chatbot
 """
 
 import os
-from typing import List, Optional
-from pydantic_settings import BaseSettings
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Optional
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import validator
 
 class Settings(BaseSettings):
     """Application settings"""
     
+    model_config = SettingsConfigDict(env_file=".env", case_sensitive=True, frozen=True)
+    
     # Application
     APP_NAME: str = "BI Toba Self-Service Chatbot"
     DEBUG: bool = False
@@ -24,12 +27,17 @@ class Settings(BaseSettings):
     PGDATABASE_PORT: str
     DATABASE_POOL_SIZE: int = 10
     DATABASE_MAX_OVERFLOW: int = 20
+    DATABASE_POOL_TIMEOUT: int = 5  # seconds
+    DATABASE_POOL_RECYCLE: int = 1800  # seconds
+    DATABASE_INTROSPECTION_POOL_SIZE: int = 2
+    DATABASE_STATEMENT_CACHE_SIZE: int = 200  # prepared statements kept per connection
     
     # OpenAI/LLM
     OPENAI_API_KEY: str
     OPENAI_MODEL: str = "gpt-4o-mini"
     OPENAI_MAX_TOKENS: int = 2000
     OPENAI_TEMPERATURE: float = 0.1
+    OPENAI_TIMEOUT_S: float = 15.0  # per attempt, applied to every completion
     
     # Security
     ALLOWED_HOSTS: List[str] = ["*"]
@@ -39,6 +47,7 @@ class Settings(BaseSettings):
     JWT_SECRET_KEY: str
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    BCRYPT_ROUNDS: int = 12
     
     # Rate limiting
     RATE_LIMIT_PER_MINUTE: int = 60
@@ -49,6 +58,8 @@ class Settings(BaseSettings):
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379"
+    REDIS_MAX_CONNECTIONS: int = 200
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30  # seconds
     
     # Logging
     LOG_LEVEL: str = "INFO"
@@ -56,7 +67,11 @@ class Settings(BaseSettings):
     
     # BI Schema settings
     BI_SCHEMAS: List[str]
-    READONLY_TABLES: List[str]
+    READONLY_TABLES: FrozenSet[str]  # checked on every request, so keep lookups O(1)
+    
+    # Precomputed metrics: name, sql, questions and optionally description and
+    # refresh_seconds; each SQL is validated like generated SQL before serving
+    PRECOMPUTED_METRICS: List[Dict[str, Any]] = []
     
     @validator("DATABASE_URL")
     def validate_database_url(cls, v):
@@ -69,13 +84,18 @@ class Settings(BaseSettings):
         if not v:
             raise ValueError("OPENAI_API_KEY must be set")
         return v
-    
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
 
-# Create settings instance
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Get settings instance, reading the environment on first use"""
+    return Settings()
+
+def __getattr__(name: str):
+    # Keep `from api.core.config import settings` working without
+    # building Settings when the module is imported
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Database schema information for LLM context
 BI_SCHEMA_INFO = {
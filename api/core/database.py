@@ -3,28 +3,68 @@ Database connection and schema management
 """
 
 import asyncio
-from typing import Dict, List, Optional
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import contextlib
+import functools
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncpg
 import pandas as pd
+import sqlparse
+from sqlparse import tokens as sql_tokens
+from cachetools import TTLCache
 from sqlalchemy import create_engine, text, MetaData, Table, Column, inspect
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 import structlog
 
-from api.core.config import settings, BI_SCHEMA_INFO
+from api.core.config import get_settings, BI_SCHEMA_INFO
 
 logger = structlog.get_logger()
 
 # Database engines
 sync_engine = None
 async_engine = None
+async_pool = None
 AsyncSessionLocal = None
 inspector = None
 
+# Schema introspection cache, keyed on a catalog version fingerprint
+_SCHEMA_CACHE: Dict = {"version": None, "schema_info": None}
+_schema_lock = asyncio.Lock()
+
+# information_schema.columns results per (schema, table)
+_TABLE_SCHEMA_CACHE: TTLCache = TTLCache(maxsize=512, ttl=300)
+
+# Statement-level keywords that must not appear anywhere in a query
+_BLOCKED_TOKEN_TYPES = frozenset({sql_tokens.DML, sql_tokens.DDL})
+
+# Cheap probe over pg_class: any DDL touching a relation in the BI schemas
+# rewrites its pg_class row (new xmin), so the fingerprint changes with it
+SCHEMA_VERSION_QUERY = """
+    SELECT md5(string_agg(c.oid::text || ':' || c.xmin::text, ',' ORDER BY c.oid))
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = ANY($1::text[])
+"""
+
+CONNECTION_TEST_QUERY = "SELECT 1"
+
+TABLE_SCHEMA_QUERY = """
+    SELECT 
+        column_name,
+        data_type,
+        is_nullable,
+        column_default
+    FROM information_schema.columns 
+    WHERE table_schema = :schema 
+    AND table_name = :table_name
+    ORDER BY ordinal_position
+"""
+
 async def init_db():
     """Initialize database connections"""
-    global sync_engine, async_engine, AsyncSessionLocal, inspector
+    global sync_engine, async_engine, async_pool, AsyncSessionLocal, inspector
+    settings = get_settings()
     
     if async_engine is not None:
         return  # Already initialized
@@ -32,12 +72,16 @@ async def init_db():
     SQLALCHEMY_DATABASE_URL = f"postgresql://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}@{settings.PGDATABASE_HOSTNAME}:{settings.PGDATABASE_PORT}/{settings.PGDATABASE_PANDAWA}"
     
     try:
-        # Create async engine for query execution
+        # Async engine for its dialect (bind compilation, identifier quoting) and
+        # get_db_session; queries run on async_pool, so it holds no idle connections
         async_engine = create_async_engine(
             SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://"),
-            pool_size=settings.DATABASE_POOL_SIZE,
-            max_overflow=settings.DATABASE_MAX_OVERFLOW,
-            echo=settings.DEBUG
+            poolclass=NullPool,
+            echo=settings.DEBUG,
+            connect_args={
+                "prepared_statement_cache_size": settings.DATABASE_STATEMENT_CACHE_SIZE,
+                "statement_cache_size": settings.DATABASE_STATEMENT_CACHE_SIZE
+            }
         )
         
         AsyncSessionLocal = sessionmaker(
@@ -46,96 +90,229 @@ async def init_db():
             expire_on_commit=False
         )
         
-        # Create sync engine for schema introspection
+        # Create sync engine for schema introspection; it only needs a couple of connections
         sync_engine = create_engine(
             SQLALCHEMY_DATABASE_URL,
-            pool_size=settings.DATABASE_POOL_SIZE,
-            max_overflow=settings.DATABASE_MAX_OVERFLOW,
+            pool_size=settings.DATABASE_INTROSPECTION_POOL_SIZE,
+            max_overflow=0,
+            pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+            pool_recycle=settings.DATABASE_POOL_RECYCLE,
+            pool_pre_ping=True,
             echo=settings.DEBUG
         )
         inspector = inspect(sync_engine)
         
-        # Test connection
-        async with async_engine.begin() as conn:
-            await conn.execute(text("SELECT 1"))
+        # Raw asyncpg pool for every query and probe; fetch() prepares each
+        # distinct SQL text once per connection and reuses it from this cache
+        async_pool = await asyncpg.create_pool(
+            SQLALCHEMY_DATABASE_URL,
+            min_size=settings.DATABASE_POOL_SIZE,
+            max_size=settings.DATABASE_POOL_SIZE + settings.DATABASE_MAX_OVERFLOW,
+            max_inactive_connection_lifetime=settings.DATABASE_POOL_RECYCLE,
+            statement_cache_size=settings.DATABASE_STATEMENT_CACHE_SIZE
+        )
+        
+        # Test connection; a read-only probe needs no transaction
+        async with async_pool.acquire() as conn:
+            await conn.fetchval(CONNECTION_TEST_QUERY)
         
         logger.info("Database connection established successfully")
         
+        # Warm the schema cache so the first chat request doesn't pay for introspection
+        await get_schema_info()
+        
     except Exception as e:
         logger.error("Failed to initialize database", error=str(e))
         raise
 
+async def close_db():
+    """Close database pools"""
+    if async_pool is not None:
+        await async_pool.close()
+    if async_engine is not None:
+        await async_engine.dispose()
+
 async def get_db_session():
     """Get database session"""
     async with AsyncSessionLocal() as session:
         yield session
 
-def get_sync_connection():
-    """Get synchronous database connection"""
-    return psycopg2.connect(
-        settings.DATABASE_URL,
-        cursor_factory=RealDictCursor
-    )
+async def get_schema_version() -> Optional[str]:
+    """Get a fingerprint of the catalog state for the BI schemas"""
+    try:
+        async with async_pool.acquire() as conn:
+            return await conn.fetchval(SCHEMA_VERSION_QUERY, list(get_settings().BI_SCHEMAS))
+    except Exception as e:
+        logger.warning("Could not probe schema version", error=str(e))
+        return None
+
+@functools.lru_cache(maxsize=64)
+def _tables_for(schema: str) -> List[str]:
+    """Get table names for a schema (memoized)"""
+    return inspector.get_table_names(schema=schema)
+
+@functools.lru_cache(maxsize=1024)
+def _columns_for(schema: str, table: str) -> List[Dict]:
+    """Get column definitions for a table (memoized)"""
+    return inspector.get_columns(table, schema=schema)
+
+def clear_schema_cache():
+    """Drop all memoized introspection results, e.g. after DDL"""
+    _tables_for.cache_clear()
+    _columns_for.cache_clear()
+    _TABLE_SCHEMA_CACHE.clear()
+    if inspector is not None:
+        inspector.clear_cache()
+
+async def _inspect_schema(schema: str, slots: asyncio.Semaphore) -> Dict:
+    """Introspect all tables of one schema, fetching columns concurrently"""
+    async def in_thread(func, *args):
+        # Each blocking inspector call holds one introspection pool connection
+        async with slots:
+            return await asyncio.to_thread(func, *args)
+    
+    table_descriptions = BI_SCHEMA_INFO.get(schema, {}).get("tables", {})
+    tables = {}
+    
+    try:
+        table_names = await in_thread(_tables_for, schema)
+        columns_list = await asyncio.gather(
+            *[in_thread(_columns_for, schema, table) for table in table_names]
+        )
+        for table, columns in zip(table_names, columns_list):
+            tables[table] = {
+                "description": table_descriptions.get(table, ""),
+                "columns": {col["name"]: col["type"].__class__.__name__ for col in columns}
+            }
+    except Exception as e:
+        logger.warning(f"Could not inspect schema {schema}", error=str(e))
+    
+    return {
+        "description": BI_SCHEMA_INFO.get(schema, {}).get("description", ""),
+        "tables": tables
+    }
+
+async def _build_schema_info() -> Dict:
+    """Introspect the BI schemas, in parallel up to the introspection pool size"""
+    slots = asyncio.Semaphore(sync_engine.pool.size())
+    schemas = list(get_settings().BI_SCHEMAS)
+    results = await asyncio.gather(*[_inspect_schema(schema, slots) for schema in schemas])
+    return dict(zip(schemas, results))
+
+def _schema_cache_valid(version: Optional[str]) -> bool:
+    """Check whether the cached schema info matches the probed version"""
+    if _SCHEMA_CACHE["schema_info"] is None:
+        return False
+    # Keep serving the cached copy if the probe itself failed
+    return version is None or version == _SCHEMA_CACHE["version"]
 
 async def get_schema_info() -> Dict:
     """Get database schema information for LLM context"""
-    schema_info = {}
+    version = await get_schema_version()
+    if _schema_cache_valid(version):
+        return _SCHEMA_CACHE["schema_info"]
     
-    for schema in settings.BI_SCHEMAS:
-        schema_info[schema] = {
-            "description": BI_SCHEMA_INFO.get(schema, {}).get("description", ""),
-            "tables": {}
-        }
+    async with _schema_lock:
+        # Another request may have rebuilt the cache while we waited
+        if _schema_cache_valid(version):
+            return _SCHEMA_CACHE["schema_info"]
         
-        try:
-            tables = inspector.get_table_names(schema=schema)
-            for table in tables:
-                columns = inspector.get_columns(table, schema=schema)
-                column_info = {col["name"]: col["type"].__class__.__name__ for col in columns}
-                
-                schema_info[schema]["tables"][table] = {
-                    "description": BI_SCHEMA_INFO.get(schema, {}).get("tables", {}).get(table, ""),
-                    "columns": column_info
-                }
-        except Exception as e:
-            logger.warning(f"Could not inspect schema {schema}", error=str(e))
-    
-    return schema_info
+        clear_schema_cache()
+        schema_info = await _build_schema_info()
+        
+        _SCHEMA_CACHE["version"] = version
+        _SCHEMA_CACHE["schema_info"] = schema_info
+        logger.info("Schema info cache rebuilt", version=version)
+        return schema_info
 
-async def execute_query(query: str, limit: int = None) -> Dict:
-    """Execute SQL query safely"""  
+# Parsing with sqlparse is the costly part of running a query, and the same
+# texts (cached generations, sample and schema lookups) come back constantly
+@functools.lru_cache(maxsize=256)
+def _prepare_query(query: str, limit: int = None) -> str:
+    """Check a query for dangerous operations and apply the row limit"""
     # Basic query validation
     query = query.strip()
     if not query:
         raise ValueError("Query cannot be empty")
     
-    # Check for dangerous operations
-    dangerous_keywords = ["DROP", "DELETE", "UPDATE", "INSERT", "CREATE", "ALTER", "TRUNCATE"]
-    query_upper = query.upper()
-    for keyword in dangerous_keywords:
-        if keyword in query_upper:
-            raise ValueError(f"Operation {keyword} is not allowed")
+    # Drop comments first: a trailing "-- note" would swallow the LIMIT added
+    # below, and the closing parenthesis COPY wraps the query in
+    query = sqlparse.format(query, strip_comments=True).strip()
+    statements = [stmt for stmt in sqlparse.parse(query) if str(stmt).strip()]
+    if len(statements) != 1:
+        raise ValueError("Only a single statement is allowed")
+    statement = statements[0]
+    
+    if statement.get_type() != "SELECT":
+        raise ValueError("Only SELECT queries are allowed")
     
-    # Add LIMIT if not present and limit is specified
-    if limit and "LIMIT" not in query_upper:
+    # Check for dangerous operations; works on tokens, so string literals
+    # and identifiers like created_at don't trip it. Data-modifying CTEs
+    # and SELECT ... FOR UPDATE still report as SELECT, hence the scan.
+    for token in statement.flatten():
+        if token.ttype in _BLOCKED_TOKEN_TYPES and token.normalized != "SELECT":
+            raise ValueError(f"Operation {token.normalized} is not allowed")
+    
+    query = str(statement).strip().rstrip(";").rstrip()
+    
+    # Add LIMIT if the outer query has none and limit is specified
+    has_limit = any(
+        token.ttype is sql_tokens.Keyword and token.normalized == "LIMIT"
+        for token in statement.tokens
+    )
+    if limit and not has_limit:
         query += f" LIMIT {limit}"
     
+    return query
+
+@functools.lru_cache(maxsize=256)
+def _compile_text(query: str):
+    """Compile a text() query for asyncpg once per distinct query string"""
+    return text(query).compile(dialect=async_engine.dialect)
+
+def _bind_params(query: str, params: Dict) -> Tuple[str, List]:
+    """Convert :name bind parameters to asyncpg's positional $n arguments"""
+    compiled = _compile_text(query)
+    values = compiled.construct_params(params)
+    return compiled.string, [values[name] for name in compiled.positiontup]
+
+async def execute_query(
+    query: str,
+    limit: int = None,
+    params: Optional[Dict] = None,
+    args: Optional[List] = None
+) -> Dict:
+    """Execute SQL query safely
+    
+    ``params`` binds :name placeholders and is only for SQL written here;
+    ``args`` are passed through to $n placeholders untouched.
+    """  
+    query = _prepare_query(query, limit)
+    if params:
+        query, args = _bind_params(query, params)
+    args = args or []
+    
     try:
-        async with async_engine.begin() as conn:
-            result = await conn.execute(text(query))
+        # Plain fetch outside a transaction: read-only queries don't need
+        # the BEGIN/COMMIT round-trips of engine.begin()
+        async with async_pool.acquire() as conn:
+            rows = await conn.fetch(query, *args)
             
-            if result.returns_rows:
-                rows = result.fetchall()
-                columns = result.keys()
-                
-                # Convert to list of dicts
-                data = [dict(zip(columns, row)) for row in rows]
+            if rows:
+                columns = list(rows[0].keys())
+            else:
+                statement = await conn.prepare(query)
+                columns = [attr.name for attr in statement.get_attributes()]
+            
+            if columns:
+                # The response and export payloads need plain dicts
+                data = [dict(row) for row in rows]
                 
                 return {
                     "success": True,
                     "data": data,
                     "row_count": len(data),
-                    "columns": list(columns)
+                    "columns": columns
                 }
             else:
                 return {
@@ -150,27 +327,59 @@ async def execute_query(query: str, limit: int = None) -> Dict:
         logger.error("Query execution failed", query=query, error=str(e))
         raise ValueError(f"Query execution failed: {str(e)}")
 
+async def stream_query_csv(query: str, limit: int = None) -> AsyncIterator[bytes]:
+    """Stream query results as CSV straight from Postgres via COPY ... TO STDOUT"""
+    query = _prepare_query(query, limit)
+    
+    # asyncpg pushes COPY data into a callback; the bounded queue hands it
+    # to this generator while providing backpressure from the client
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=16)
+    
+    async with async_pool.acquire() as conn:
+        async def copy_out():
+            try:
+                await conn.copy_from_query(
+                    query, output=chunks.put, format="csv", header=True
+                )
+            finally:
+                await chunks.put(None)
+        
+        copy_task = asyncio.create_task(copy_out())
+        try:
+            while (chunk := await chunks.get()) is not None:
+                yield chunk
+            await copy_task
+        except Exception as e:
+            logger.error("CSV stream failed", query=query, error=str(e))
+            raise
+        finally:
+            if not copy_task.done():
+                # Client went away: stop COPY and make room for the sentinel
+                copy_task.cancel()
+                while not chunks.empty():
+                    chunks.get_nowait()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await copy_task
+
 async def get_table_sample(table_name: str, schema: str = "bi_reports", limit: int = 5) -> Dict:
     """Get sample data from a table"""
-    query = f"SELECT * FROM {schema}.{table_name} LIMIT {limit}"
-    return await execute_query(query)
+    # Identifiers can't be bound, so quote them; the limit stays a parameter
+    preparer = async_engine.dialect.identifier_preparer
+    query = f"SELECT * FROM {preparer.quote_schema(schema)}.{preparer.quote(table_name)} LIMIT :limit"
+    return await execute_query(query, params={"limit": limit})
 
 async def get_table_schema(table_name: str, schema: str = "bi_reports") -> Dict:
     """Get table schema information"""
-    query = f"""
-    SELECT 
-        column_name,
-        data_type,
-        is_nullable,
-        column_default
-    FROM information_schema.columns 
-    WHERE table_schema = '{schema}' 
-    AND table_name = '{table_name}'
-    ORDER BY ordinal_position
-    """
-    return await execute_query(query)
+    cache_key = (schema, table_name)
+    cached = _TABLE_SCHEMA_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    result = await execute_query(TABLE_SCHEMA_QUERY, params={"schema": schema, "table_name": table_name})
+    _TABLE_SCHEMA_CACHE[cache_key] = result
+    return result
 
 def validate_table_access(table_name: str, schema: str = "bi_reports") -> bool:
     """Validate if table is in readonly list"""
     full_table_name = f"{schema}.{table_name}"
-    return full_table_name in settings.READONLY_TABLES 
\ No newline at end of file
+    return full_table_name in get_settings().READONLY_TABLES 
\ No newline at end of file
@@ -0,0 +1,35 @@
+"""
+Shared OpenAI client for the chatbot
+"""
+
+from typing import Optional
+import httpx
+from openai import AsyncOpenAI
+
+from api.core.config import get_settings
+
+_client: Optional[AsyncOpenAI] = None
+
+def get_openai_client() -> AsyncOpenAI:
+    """Get the process-wide OpenAI client, creating it on first use"""
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(
+            api_key=get_settings().OPENAI_API_KEY,
+            # One connection pool for every caller, so requests reuse warm TLS connections
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=100,
+                    max_keepalive_connections=50,
+                    keepalive_expiry=60
+                )
+            )
+        )
+    return _client
+
+async def close_openai_client():
+    """Close the OpenAI client and its connection pool"""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None 
\ No newline at end of file
@@ -2,38 +2,104 @@
 Security utilities for authentication and authorization
 """
 
+import os
+import time
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Optional, Dict
+import bcrypt
+import jwt
+from cachetools import TTLCache
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import structlog
 
+from api.core.config import get_settings
+
 logger = structlog.get_logger()
 
-# Simple token-based auth for now
+# Bearer token auth; anonymous access is allowed when no token is sent
 security = HTTPBearer(auto_error=False)
 
+# Verified tokens, keyed by a digest of the raw token. Entries outlive neither
+# the TTL nor the token's own expiry, which is checked on every hit
+_TOKEN_CACHE: TTLCache = TTLCache(maxsize=10000, ttl=60)
+
+# bcrypt is deliberately slow CPU work; keep it off the event loop and out of
+# the default executor that other to_thread/run_in_executor callers share
+_password_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="password")
+
+def verify_password(password: str, password_hash: str) -> bool:
+    """Check a password against its bcrypt hash"""
+    return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    """Check a password against its bcrypt hash without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, verify_password, password, password_hash)
+
+def hash_password(password: str) -> str:
+    """Hash a password with bcrypt"""
+    salt = bcrypt.gensalt(rounds=get_settings().BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode(), salt).decode()
+
+async def hash_password_async(password: str) -> str:
+    """Hash a password with bcrypt without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, hash_password, password)
+
+def warm_password_hashing():
+    """Load the bcrypt backend so the first login doesn't pay for it"""
+    bcrypt.hashpw(b"warmup", bcrypt.gensalt(rounds=4))
+
+@lru_cache(maxsize=1)
+def _signing_key() -> bytes:
+    """Get the JWT signing key"""
+    return get_settings().JWT_SECRET_KEY.encode()
+
+def create_access_token(user_id: str, role: str = "user") -> str:
+    """Create a signed access token for a user"""
+    settings = get_settings()
+    expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    return jwt.encode(
+        {"sub": user_id, "role": role, "exp": expire},
+        _signing_key(),
+        algorithm=settings.JWT_ALGORITHM
+    )
+
+def decode_access_token(token: str) -> Dict:
+    """Verify an access token and return the user it was issued to"""
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = _TOKEN_CACHE.get(cache_key)
+    if cached is not None:
+        user, expires_at = cached
+        if expires_at > time.time():
+            return dict(user)
+        _TOKEN_CACHE.pop(cache_key, None)
+    
+    try:
+        payload = jwt.decode(token, _signing_key(), algorithms=[get_settings().JWT_ALGORITHM])
+    except jwt.PyJWTError as e:
+        logger.warning("Invalid access token", error=str(e))
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    user = {
+        "user_id": payload["sub"],
+        "role": payload.get("role", "user")
+    }
+    _TOKEN_CACHE[cache_key] = (user, payload["exp"])
+    return dict(user)
+
 async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Dict:
     """Get current user from token"""
     if not credentials:
         # For development, allow anonymous access
         return {"user_id": "anonymous", "role": "user"}
     
-    token = credentials.credentials
-    
-    # Simple token validation (replace with proper JWT validation)
-    if not token.startswith("token_"):
-        # For development, allow access with any token
-        return {"user_id": "user", "role": "user"}
-    
-    try:
-        user_id = token.split("_")[1]
-        return {
-            "user_id": user_id,
-            "role": "user"  # In production, get from token claims
-        }
-    except IndexError:
-        # For development, allow access even with invalid token format
-        return {"user_id": "user", "role": "user"}
+    return decode_access_token(credentials.credentials)
 
 def require_admin(user: Dict = Depends(get_current_user)) -> Dict:
     """Require admin role"""
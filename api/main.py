@@ -4,6 +4,7 @@ Main FastAPI application for natural language query processing
 """
 
 import os
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends
@@ -13,15 +14,21 @@ from fastapi.responses import JSONResponse
 import structlog
 
 from api.routers import chat, auth, health, export
-from api.core.config import settings
-from api.core.database import init_db
-from api.core.security import get_current_user
+from api.core.config import get_settings
+from api.core.database import init_db, close_db
+from api.core.openai_client import close_openai_client
+from api.core.security import get_current_user, warm_password_hashing
+from api.services.metric_aggregator import metric_aggregator
+from api.utils.cache import init_redis, close_redis
+from api.utils.health_interceptor import HealthCheckInterceptor
 from api.utils.logging import setup_logging
 
 # Setup structured logging
 setup_logging()
 logger = structlog.get_logger()
 
+settings = get_settings()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan events.
@@ -32,11 +39,19 @@ async def lifespan(app: FastAPI):
     logger.info("Starting BI Toba Self-Service Chatbot API")
     await init_db()
     logger.info("Database connection established")
+    init_redis()
+    warm_password_hashing()
+    
+    metrics_task = asyncio.create_task(metric_aggregator.refresh_loop())
     
     yield
     
     # Shutdown
     logger.info("Shutting down BI Self-Service Chatbot API")
+    metrics_task.cancel()
+    await close_db()
+    await close_redis()
+    await close_openai_client()
 
 # Create FastAPI app
 app = FastAPI(
@@ -62,6 +77,9 @@ app.add_middleware(
     allowed_hosts=settings.ALLOWED_HOSTS
 )
 
+# Added last so it wraps everything else: probes skip the whole stack
+app.add_middleware(HealthCheckInterceptor)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["authentication"])
 app.include_router(health.router, prefix="/api/v1/health", tags=["health"])
@@ -102,5 +120,8 @@ if __name__ == "__main__":
         "main:app",
         host="0.0.0.0",
         port=8000,
+        loop="uvloop",
+        http="httptools",
+        timeout_keep_alive=30,
         reload=settings.DEBUG
     )
\ No newline at end of file
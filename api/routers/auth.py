@@ -7,7 +7,8 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 import structlog
 
-from api.core.config import settings
+from api.core.config import get_settings
+from api.core.security import create_access_token, decode_access_token, verify_password_async
 
 logger = structlog.get_logger()
 router = APIRouter()
@@ -27,12 +28,12 @@ class LoginResponse(BaseModel):
 # Placeholder user database (replace with real auth system)
 USERS = {
     "admin": {
-        "password": "admin",  # In production, use hashed passwords
+        "password_hash": "$2b$12$pJvATk77z1AZTr6x2xBw8ev6tjPvuLjK.7.4EfXvkeVYIv/j3aAiC",  # "admin"
         "user_id": "admin",
         "role": "admin"
     },
     "user": {
-        "password": "user",
+        "password_hash": "$2b$12$dBVUidBxR6MBS4LmjbXFPObIHk8eXA7ByDSnPzGODiNGtlbeENJI2",  # "user"
         "user_id": "user", 
         "role": "user"
     }
@@ -43,11 +44,10 @@ async def login(request: LoginRequest):
     """Login endpoint"""
     user = USERS.get(request.username)
     
-    if not user or user["password"] != request.password:
+    if not user or not await verify_password_async(request.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    # In production, generate proper JWT tokens
-    token = f"token_{user['user_id']}_{hash(request.username)}"
+    token = create_access_token(user["user_id"], user["role"])
     
     logger.info("User logged in", user_id=user["user_id"])
     
@@ -59,41 +59,10 @@ async def login(request: LoginRequest):
 @router.get("/me")
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current user information"""
-    # Simple token validation (replace with proper JWT validation)
-    token = credentials.credentials
-    
-    if not token.startswith("token_"):
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    # Extract user ID from token
-    try:
-        user_id = token.split("_")[1]
-        return {
-            "user_id": user_id,
-            "role": "user"  # In production, get from token claims
-        }
-    except IndexError:
-        raise HTTPException(status_code=401, detail="Invalid token format")
+    return decode_access_token(credentials.credentials)
 
 @router.post("/logout")
 async def logout():
     """Logout endpoint"""
     # In production, invalidate the token
-    return {"message": "Logged out successfully"}
-
-# Dependency for getting current user
-async def get_current_user_dependency(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Dependency for getting current user"""
-    token = credentials.credentials
-    
-    if not token.startswith("token_"):
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
-    try:
-        user_id = token.split("_")[1]
-        return {
-            "user_id": user_id,
-            "role": "user"
-        }
-    except IndexError:
-        raise HTTPException(status_code=401, detail="Invalid token format") 
\ No newline at end of file
+    return {"message": "Logged out successfully"} 
\ No newline at end of file
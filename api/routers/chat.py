@@ -3,17 +3,18 @@ Chat router for natural language query processing
 """
 
 import asyncio
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import structlog
 
 from api.core.database import execute_query, get_schema_info, validate_table_access
-from api.core.config import settings
+from api.core.config import get_settings
 from api.services.llm_service import LLMService
+from api.services.metric_aggregator import metric_aggregator
 from api.services.query_validator import QueryValidator
-from api.utils.cache import get_cache, set_cache
+from api.utils.cache import cache_page_query, get_cache, get_cached_page_query, set_cache
 from api.utils.rate_limiter import check_rate_limit
 
 logger = structlog.get_logger()
@@ -21,13 +22,15 @@ logger = structlog.get_logger()
 router = APIRouter()
 
 # Initialize services
-llm_service = LLMService()
 query_validator = QueryValidator()
+llm_service = LLMService(query_validator)
 
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
     user_id: Optional[str] = None
+    page_size: Optional[int] = None
+    cursor: Optional[str] = None
 
 class ChatResponse(BaseModel):
     message: str
@@ -36,6 +39,7 @@ class ChatResponse(BaseModel):
     error: Optional[str] = None
     conversation_id: str
     timestamp: str
+    next_cursor: Optional[str] = None
 
 @router.post("/query", response_model=ChatResponse)
 async def process_query(
@@ -54,32 +58,47 @@ async def process_query(
         # Get conversation context
         conversation_id = request.conversation_id or f"conv_{user_id}_{asyncio.get_event_loop().time()}"
         
-        # Get schema information for LLM context
-        schema_info = await get_schema_info()
-        
-        # Generate SQL from natural language
-        generated_output = await llm_service.generate_sql(
-            user_query=request.message,
-            schema_info=schema_info,
-            conversation_id=conversation_id
-        )
-        
-        # --- Detect mode ---
-        stripped_output = generated_output.strip().lower()
-        is_sql = stripped_output.startswith("select") or stripped_output.startswith("with")
-        
-        if not is_sql:
-            # Treat as explanation only
-            return ChatResponse(
-                message=generated_output,
-                conversation_id=conversation_id,
-                timestamp=str(asyncio.get_event_loop().time())
+        if request.cursor:
+            # Later pages replay the SQL stored with the first one instead of generating again
+            sql_query = await get_page_query(request)
+        else:
+            # Answer from precomputed aggregates when possible
+            metric = metric_aggregator.match(request.message)
+            if metric and not request.page_size:
+                return ChatResponse(
+                    message=metric_aggregator.format_message(metric),
+                    sql_query=metric["sql"],
+                    results=metric["last_value"],
+                    conversation_id=conversation_id,
+                    timestamp=str(asyncio.get_event_loop().time())
+                )
+            
+            # Get schema information for LLM context
+            schema_info = await get_schema_info()
+            
+            # Generate SQL using LLM; repeat questions are served from its cache
+            generated_output = await llm_service.generate_sql(
+                user_query=request.message,
+                schema_info=schema_info,
+                conversation_id=conversation_id
             )
+            
+            # --- Detect mode ---
+            stripped_output = generated_output.strip().lower()
+            is_sql = stripped_output.startswith("select") or stripped_output.startswith("with")
+            
+            if not is_sql:
+                # Treat as explanation only
+                return ChatResponse(
+                    message=generated_output,
+                    conversation_id=conversation_id,
+                    timestamp=str(asyncio.get_event_loop().time())
+                )
+            
+            # --- SQL mode ---
+            sql_query = generated_output
         
-        # --- SQL mode ---
-        sql_query = generated_output
-        
-        # Validate generated SQL
+        # Validate generated or replayed SQL
         validation_result = await query_validator.validate_query(sql_query)
         if not validation_result["is_valid"]:
             return ChatResponse(
@@ -88,8 +107,19 @@ async def process_query(
                 timestamp=str(asyncio.get_event_loop().time())
             )
         
-        # Execute query
-        results = await execute_query(sql_query, limit=settings.MAX_RESULT_ROWS)
+        # Execute query, one keyset page at a time if the client asked for it
+        next_cursor = None
+        page = None
+        if request.page_size:
+            page_size = max(1, min(request.page_size, get_settings().MAX_RESULT_ROWS))
+            page = query_validator.paginate_query(sql_query, page_size, request.cursor)
+        
+        if page:
+            results, next_cursor = await execute_page(page)
+            if next_cursor:
+                await cache_page_query(page["query_id"], sql_query)
+        else:
+            results = await execute_query(sql_query, limit=get_settings().MAX_RESULT_ROWS)
         
         # Format response message
         response_message = format_response_message(request.message, results)
@@ -108,7 +138,8 @@ async def process_query(
             sql_query=sql_query,
             results=results,
             conversation_id=conversation_id,
-            timestamp=str(asyncio.get_event_loop().time())
+            timestamp=str(asyncio.get_event_loop().time()),
+            next_cursor=next_cursor
         )
         
     except Exception as e:
@@ -165,6 +196,35 @@ async def get_table_schema_info(schema: str, table: str):
         logger.error("Failed to get table schema", error=str(e))
         raise HTTPException(status_code=500, detail="Failed to get table schema")
 
+async def execute_page(page: Dict) -> Tuple[Dict, Optional[str]]:
+    """Execute a paginated query and build the cursor for the following page"""
+    results = await execute_query(page["query"], args=page["args"])
+    
+    rows = results["data"]
+    next_cursor = None
+    if len(rows) > page["page_size"]:
+        del rows[page["page_size"]:]
+        results["row_count"] = len(rows)
+        next_cursor = query_validator.encode_cursor(
+            page["sort_key"],
+            rows[-1].get(page["sort_key"]),
+            page["descending"],
+            page["query_id"]
+        )
+    
+    return results, next_cursor
+
+async def get_page_query(request: ChatRequest) -> str:
+    """Load the SQL a pagination cursor was issued for"""
+    if not request.page_size:
+        raise ValueError("A pagination cursor requires page_size")
+    
+    query_id = query_validator.decode_cursor(request.cursor)["query_id"]
+    sql_query = await get_cached_page_query(query_id) if query_id else None
+    if not sql_query:
+        raise ValueError("Pagination cursor has expired, please ask the question again")
+    return sql_query
+
 def format_response_message(original_query: str, results: Dict) -> str:
     """Format response message based on results"""
     if not results.get("success"):
@@ -3,20 +3,126 @@ Export router for downloading query results
 """
 
 import csv
-import json
-from io import StringIO
-from typing import List, Dict
+from collections import defaultdict
+from operator import itemgetter
+from typing import AsyncIterator, Callable, List, Dict
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
+import orjson
 import structlog
 
+from api.core.config import get_settings
+from api.core.database import stream_query_csv
+from api.services.query_validator import QueryValidator
+
 logger = structlog.get_logger()
 router = APIRouter()
 
+query_validator = QueryValidator()
+
+# orjson handles datetime/UUID natively; Decimal and friends fall back to str
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+# Rows rendered per streamed chunk
+CSV_BATCH_ROWS = 500
+
+class _RowSink:
+    """File-like target for csv.writer that collects rendered rows"""
+    
+    def __init__(self):
+        self.parts = []
+    
+    def write(self, value: str):
+        self.parts.append(value)
+    
+    def drain(self) -> str:
+        data = "".join(self.parts)
+        self.parts.clear()
+        return data
+
+def _row_values(columns: List[str]) -> Callable[[Dict], tuple]:
+    """Build a function returning a row's values in column order"""
+    getter = itemgetter(*columns) if columns else (lambda row: ())
+    single = len(columns) == 1
+    
+    def values(row: Dict) -> tuple:
+        try:
+            result = getter(row)
+        except KeyError:
+            # Missing columns export as empty cells
+            result = getter(defaultdict(str, row))
+        return (result,) if single else result
+    
+    return values
+
+# Async generators keep StreamingResponse from hopping to a thread per chunk
+async def _iter_csv(columns: List[str], rows: List[Dict]) -> AsyncIterator[str]:
+    """Yield a CSV document in batches of rows"""
+    sink = _RowSink()
+    writer = csv.writer(sink)
+    
+    writer.writerow(columns)
+    yield sink.drain()
+    
+    values = _row_values(columns)
+    for start in range(0, len(rows), CSV_BATCH_ROWS):
+        writer.writerows(map(values, rows[start:start + CSV_BATCH_ROWS]))
+        yield sink.drain()
+
+async def _iter_json(export_data: Dict, rows: List[Dict]) -> AsyncIterator[bytes]:
+    """Yield a JSON export document with one data row per chunk"""
+    header = orjson.dumps(export_data)
+    # Reopen the metadata object and stream the "data" array into it
+    yield header[:-1] + b',"data":['
+    
+    for i, row in enumerate(rows):
+        yield (b"," if i else b"") + b"\n" + orjson.dumps(row, default=str, option=ORJSON_OPTIONS)
+    
+    yield b"\n]}"
+
+async def _prepend(first: bytes, rest: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Yield an already fetched chunk, then the rest of the stream"""
+    if first:
+        yield first
+    async for chunk in rest:
+        yield chunk
+
+async def _stream_sql_csv(data: Dict) -> StreamingResponse:
+    """Re-run the exported query in Postgres and stream its CSV output"""
+    sql_query = data["sql_query"]
+    
+    validation_result = await query_validator.validate_query(sql_query)
+    if not validation_result["is_valid"]:
+        raise HTTPException(status_code=400, detail=validation_result["error"])
+    
+    # Wait for the first chunk before answering: once StreamingResponse has sent
+    # its 200 a failing query could only cut the file short
+    chunks = stream_query_csv(sql_query, limit=get_settings().MAX_RESULT_ROWS)
+    try:
+        first_chunk = await anext(chunks, b"")
+    except ValueError as e:
+        # Rejected by the query checks before it reached Postgres
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StreamingResponse(
+        _prepend(first_chunk, chunks),
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": f"attachment; filename=bi_export_{data.get('timestamp', 'data')}.csv"
+        }
+    )
+
 @router.post("/csv")
 async def export_csv(data: Dict):
-    """Export data as CSV"""
+    """Export data as CSV
+    
+    Accepts either the chat ``results`` payload or just ``{sql_query, timestamp}``,
+    in which case the query is streamed from the database with COPY.
+    """
     try:
+        if not data.get("results") and data.get("sql_query"):
+            return await _stream_sql_csv(data)
+        
         if not data.get("results") or not data["results"].get("data"):
             raise HTTPException(status_code=400, detail="No data to export")
         
@@ -24,31 +130,16 @@ async def export_csv(data: Dict):
         columns = results.get("columns", [])
         rows = results.get("data", [])
         
-        # Create CSV content
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(columns)
-        
-        # Write data rows
-        for row in rows:
-            writer.writerow([row.get(col, "") for col in columns])
-        
-        output.seek(0)
-        
-        # Create streaming response
-        def generate():
-            yield output.getvalue()
-        
         return StreamingResponse(
-            generate(),
+            _iter_csv(columns, rows),
             media_type="text/csv",
             headers={
                 "Content-Disposition": f"attachment; filename=bi_export_{data.get('timestamp', 'data')}.csv"
             }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error("CSV export failed", error=str(e))
         raise HTTPException(status_code=500, detail="Export failed")
@@ -60,17 +151,16 @@ async def export_json(data: Dict):
         if not data.get("results") or not data["results"].get("data"):
             raise HTTPException(status_code=400, detail="No data to export")
         
-        # Create JSON response
+        # Metadata goes out first, rows are streamed after it
         export_data = {
             "export_timestamp": data.get("timestamp"),
             "query": data.get("sql_query"),
             "columns": data["results"].get("columns", []),
-            "data": data["results"].get("data", []),
             "row_count": data["results"].get("row_count", 0)
         }
         
         return StreamingResponse(
-            iter([json.dumps(export_data, indent=2)]),
+            _iter_json(export_data, data["results"].get("data", [])),
             media_type="application/json",
             headers={
                 "Content-Disposition": f"attachment; filename=bi_export_{data.get('timestamp', 'data')}.json"
@@ -94,24 +184,8 @@ async def export_excel(data: Dict):
         columns = results.get("columns", [])
         rows = results.get("data", [])
         
-        # Create CSV content with Excel-compatible format
-        output = StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(columns)
-        
-        # Write data rows
-        for row in rows:
-            writer.writerow([row.get(col, "") for col in columns])
-        
-        output.seek(0)
-        
-        def generate():
-            yield output.getvalue()
-        
         return StreamingResponse(
-            generate(),
+            _iter_csv(columns, rows),
             media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             headers={
                 "Content-Disposition": f"attachment; filename=bi_export_{data.get('timestamp', 'data')}.xlsx"
@@ -2,26 +2,76 @@
 Health check router for monitoring
 """
 
+import asyncio
+from typing import Dict
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
 import structlog
 
 from api.core.database import init_db
-from api.utils.cache import get_cache_stats
-from api.core.config import settings
+from api.core.openai_client import get_openai_client
+from api.utils.cache import get_cache_stats, get_cache_json, set_cache_json
+from api.core.config import get_settings
 
 logger = structlog.get_logger()
 router = APIRouter()
 
-@router.get("/")
-async def health_check():
-    """Basic health check"""
+PROBE_TIMEOUT = 2.0  # seconds
+OPENAI_PROBE_TIMEOUT = 1.5  # seconds
+OPENAI_HEALTH_KEY = "health:openai"
+OPENAI_HEALTH_TTL = 60  # seconds
+OPENAI_HEALTH_FAILURE_TTL = 15  # seconds, so recovery shows up quickly
+
+async def _probe_db() -> Dict:
+    """Check database connection"""
+    await init_db()
     return {
         "status": "healthy",
-        "service": "BI Self-Service Chatbot",
-        "version": "1.0.0"
+        "message": "Database connection successful"
+    }
+
+async def _probe_cache() -> Dict:
+    """Check Redis cache"""
+    cache_stats = await get_cache_stats()
+    if not cache_stats:
+        return {
+            "status": "unhealthy",
+            "message": "Cache connection failed"
+        }
+    return {
+        "status": "healthy",
+        "message": "Cache connection successful",
+        "stats": cache_stats
     }
 
+async def _probe_openai() -> Dict:
+    """Check OpenAI API, reusing a recent verdict when there is one"""
+    cached = await get_cache_json(OPENAI_HEALTH_KEY)
+    if cached is not None:
+        return cached
+    
+    try:
+        # Retrieving model metadata proves key and connectivity without spending tokens
+        await asyncio.wait_for(
+            get_openai_client().models.retrieve(get_settings().OPENAI_MODEL),
+            timeout=OPENAI_PROBE_TIMEOUT
+        )
+    except Exception as e:
+        message = str(e) or f"timed out after {OPENAI_PROBE_TIMEOUT}s"
+        status = {
+            "status": "unhealthy",
+            "message": f"OpenAI API connection failed: {message}"
+        }
+        await set_cache_json(OPENAI_HEALTH_KEY, status, expire=OPENAI_HEALTH_FAILURE_TTL)
+        return status
+    
+    status = {
+        "status": "healthy",
+        "message": "OpenAI API connection successful"
+    }
+    await set_cache_json(OPENAI_HEALTH_KEY, status, expire=OPENAI_HEALTH_TTL)
+    return status
+
 @router.get("/detailed")
 async def detailed_health_check():
     """Detailed health check with component status"""
@@ -32,71 +82,39 @@ async def detailed_health_check():
         "components": {}
     }
     
+    probes = {
+        "database": ("Database connection failed", _probe_db),
+        "cache": ("Cache connection failed", _probe_cache)
+    }
+    # Check OpenAI API (if configured)
+    if get_settings().OPENAI_API_KEY:
+        probes["openai"] = ("OpenAI API connection failed", _probe_openai)
+    
     try:
-        # Check database connection
-        try:
-            await init_db()
-            health_status["components"]["database"] = {
-                "status": "healthy",
-                "message": "Database connection successful"
-            }
-        except Exception as e:
-            health_status["components"]["database"] = {
-                "status": "unhealthy",
-                "message": f"Database connection failed: {str(e)}"
-            }
-            health_status["status"] = "degraded"
+        # Run the probes concurrently so the endpoint takes as long as the slowest one
+        results = await asyncio.gather(
+            *(asyncio.wait_for(probe(), timeout=PROBE_TIMEOUT) for _, probe in probes.values()),
+            return_exceptions=True
+        )
         
-        # Check Redis cache
-        try:
-            cache_stats = await get_cache_stats()
-            if cache_stats:
-                health_status["components"]["cache"] = {
-                    "status": "healthy",
-                    "message": "Cache connection successful",
-                    "stats": cache_stats
-                }
-            else:
-                health_status["components"]["cache"] = {
+        for (name, (failure, _)), result in zip(probes.items(), results):
+            if isinstance(result, asyncio.TimeoutError):
+                result = {
                     "status": "unhealthy",
-                    "message": "Cache connection failed"
+                    "message": f"{failure}: timed out after {PROBE_TIMEOUT}s"
                 }
-                health_status["status"] = "degraded"
-        except Exception as e:
-            health_status["components"]["cache"] = {
-                "status": "unhealthy",
-                "message": f"Cache connection failed: {str(e)}"
-            }
-            health_status["status"] = "degraded"
-        
-        # Check OpenAI API (if configured)
-        if settings.OPENAI_API_KEY:
-            try:
-                from openai import AsyncOpenAI
-                client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-                completion = await client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "developer", "content": "You are a helpful assistant."},
-                        {"role": "user", "content": "Hello!"}
-                    ],
-                    max_tokens=5
-                )
-
-                print(completion.choices[0].message)
-                health_status["components"]["openai"] = {
-                    "status": "healthy",
-                    "message": "OpenAI API connection successful"
-                }
-            except Exception as e:
-                health_status["components"]["openai"] = {
+            elif isinstance(result, Exception):
+                result = {
                     "status": "unhealthy",
-                    "message": f"OpenAI API connection failed: {str(e)}"
+                    "message": f"{failure}: {str(result)}"
                 }
+            
+            health_status["components"][name] = result
+            if result["status"] != "healthy":
                 health_status["status"] = "degraded"
         
         return health_status
-        
+    
     except Exception as e:
         logger.error("Health check failed", error=str(e))
         raise HTTPException(status_code=500, detail="Health check failed")
@@ -110,9 +128,4 @@ async def readiness_check():
         return {"status": "ready"}
     except Exception as e:
         logger.error("Readiness check failed", error=str(e))
-        raise HTTPException(status_code=503, detail="Service not ready")
-
-@router.get("/live")
-async def liveness_check():
-    """Liveness check for Kubernetes"""
-    return {"status": "alive"} 
\ No newline at end of file
+        raise HTTPException(status_code=503, detail="Service not ready") 
\ No newline at end of file
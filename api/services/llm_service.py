@@ -2,24 +2,48 @@
 LLM Service for natural language to SQL conversion
 """
 
-import json
+import re
 import asyncio
-from typing import Dict, List, Optional
+import functools
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 import openai
-from openai import AsyncOpenAI
+import orjson
 import structlog
 
-from api.core.config import settings
-from api.utils.cache import get_cache, set_cache
+from api.core.config import get_settings
+from api.core.openai_client import get_openai_client
+from api.services.query_validator import QueryValidator
+from api.utils.cache import cache_sql_generation, get_cached_sql_generation, get_list_cache, push_list_cache
+from api.utils.text import normalize_question
 
 logger = structlog.get_logger()
+# The stdlib logger structlog routes to; asked directly so the level check works
+# whether or not setup_logging() has configured structlog
+_stdlib_logger = logging.getLogger(__name__)
+
+SCHEMA_CONTEXT_CACHE_SIZE = 16
+OPENAI_ATTEMPTS = 2
+CONVERSATION_HISTORY_LIMIT = 10  # messages
+
+SQL_START_PATTERN = re.compile(r"\s*(SELECT|WITH)\b", re.IGNORECASE)
+SQL_START_WIDTH = len("SELECT")  # characters needed to tell SQL from an explanation
 
 class LLMService:
     """Service for LLM-based SQL generation"""
     
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    def __init__(self, query_validator: Optional[QueryValidator] = None):
+        self.client = get_openai_client()
+        self.query_validator = query_validator or QueryValidator()
         self.system_prompt = self._get_system_prompt()
+        self._schema_fingerprint: Tuple[Optional[Dict], str] = (None, "")
+        self._schema_contexts: Dict[str, str] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Routes requests sharing the static prompt prefix to the same OpenAI prompt cache
+        self._prompt_cache_key = hashlib.blake2b(
+            (get_settings().OPENAI_MODEL + self.system_prompt).encode(), digest_size=8
+        ).hexdigest()
     
     def _get_system_prompt(self) -> str:
         """Get system prompt for SQL generation"""
@@ -70,131 +94,278 @@ RESPONSE RULES:
         conversation_id: Optional[str] = None
     ) -> str:
         """Generate SQL from natural language query"""
+        history = await self._get_conversation_history(conversation_id) if conversation_id else []
         
-        # Check cache first
-        cache_key = f"sql_generation:{hash(user_query)}"
-        cached_result = await get_cache(cache_key)
-        if cached_result:
+        # Check cache first; a follow-up only reuses SQL generated for the same history
+        cache_key = self._sql_cache_key(user_query, schema_info, history)
+        sql_query = await get_cached_sql_generation(cache_key)
+        if sql_query:
             logger.info("Using cached SQL generation result")
-            return cached_result
+        else:
+            sql_query = await self._generate_shared(cache_key, user_query, schema_info, history)
         
+        # Record the exchange on cache hits too, so follow-ups see it
+        if conversation_id:
+            await self._append_conversation_history(conversation_id, [
+                {"role": "user", "content": user_query},
+                {"role": "assistant", "content": sql_query}
+            ])
+        return sql_query
+    
+    async def _generate_shared(
+        self,
+        cache_key: str,
+        user_query: str,
+        schema_info: Dict,
+        history: List[Dict]
+    ) -> str:
+        """Generate and cache SQL, sharing one OpenAI call between concurrent misses"""
+        # The generation runs in its own task and every caller, the first one
+        # included, waits on it shielded: cancelling one caller leaves the rest served
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(self._generate_and_cache(cache_key, user_query, schema_info, history))
+            self._inflight[cache_key] = task
+            task.add_done_callback(functools.partial(self._forget_inflight, cache_key))
+        return await asyncio.shield(task)
+    
+    def _forget_inflight(self, cache_key: str, task: asyncio.Task):
+        """Drop a finished generation from the in-flight map"""
+        self._inflight.pop(cache_key, None)
+        # Mark a failure retrieved so asyncio doesn't warn when every caller went away
+        if not task.cancelled():
+            task.exception()
+    
+    async def _generate_and_cache(
+        self,
+        cache_key: str,
+        user_query: str,
+        schema_info: Dict,
+        history: List[Dict]
+    ) -> str:
+        """Generate SQL and cache the result"""
         try:
-            # Build context with schema information
-            schema_context = self._build_schema_context(schema_info)
-            
-            # Create messages for OpenAI
-            messages = [
-                {"role": "system", "content": self.system_prompt + "\n\n" + schema_context},
-                {"role": "user", "content": user_query}
-            ]
-            
-            # Add conversation history if available
-            if conversation_id:
-                history = await self._get_conversation_history(conversation_id)
-                if history:
-                    messages = history + messages
-            
-            # Call OpenAI
-            response = await self.client.chat.completions.create(
-                model=settings.OPENAI_MODEL,
-                messages=messages,
-                max_tokens=settings.OPENAI_MAX_TOKENS,
-                temperature=settings.OPENAI_TEMPERATURE,
-                stop=None
+            # The deadline covers opening the stream and reading it to the end
+            sql_query = await self._with_deadline(
+                lambda: self._collect_sql(user_query, schema_info, history)
             )
-            
-            sql_query = response.choices[0].message.content.strip()
-            
-            # Cache the result
-            await set_cache(cache_key, sql_query, expire=3600)  # 1 hour
-            
-            logger.info("SQL generated successfully", query=user_query, sql=sql_query)
-            return sql_query
-            
         except Exception as e:
             logger.error("Failed to generate SQL", error=str(e), query=user_query)
             raise ValueError(f"Failed to generate SQL: {str(e)}")
+        
+        # Cache the result
+        await cache_sql_generation(cache_key, sql_query, expire=3600)  # 1 hour
+        
+        # Skip binding the question and SQL into the event when INFO is filtered out
+        if _stdlib_logger.isEnabledFor(logging.INFO):
+            logger.info("SQL generated successfully", query=user_query, sql=sql_query)
+        return sql_query
+    
+    async def _collect_sql(self, user_query: str, schema_info: Dict, history: List[Dict]) -> str:
+        """Read the generated SQL stream into a single string"""
+        tokens = [token async for token in self.generate_sql_stream(user_query, schema_info, history=history)]
+        return "".join(tokens).strip()
+    
+    async def generate_sql_stream(
+        self, 
+        user_query: str, 
+        schema_info: Dict,
+        conversation_id: Optional[str] = None,
+        history: Optional[List[Dict]] = None
+    ) -> AsyncIterator[str]:
+        """Stream generated SQL tokens, aborting as soon as a write statement appears"""
+        # Build context with schema information
+        schema_context = self._build_schema_context(schema_info)
+        
+        # Order messages from most to least stable: OpenAI caches prompts by
+        # exact prefix, so the static system prompt has to come first, unchanged
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "system", "content": schema_context}
+        ]
+        
+        # Add conversation history if available
+        if history is None and conversation_id:
+            history = await self._get_conversation_history(conversation_id)
+        if history:
+            messages.extend(history)
+        
+        messages.append({"role": "user", "content": user_query})
+        
+        # Call OpenAI; the timeout bounds each read, callers bound the whole stream
+        stream = await self.client.chat.completions.create(
+            timeout=get_settings().OPENAI_TIMEOUT_S,
+            model=get_settings().OPENAI_MODEL,
+            messages=messages,
+            max_tokens=get_settings().OPENAI_MAX_TOKENS,
+            temperature=get_settings().OPENAI_TEMPERATURE,
+            stop=None,
+            stream=True,
+            extra_body={"prompt_cache_key": self._prompt_cache_key}
+        )
+        
+        # Explanations may mention these words freely; once the output reads as SQL,
+        # each finished word is checked with the validator's own keyword pattern
+        head = ""
+        is_sql = None
+        unfinished = ""
+        try:
+            async for chunk in stream:
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if not token:
+                    continue
+                
+                if is_sql is None:
+                    head += token
+                    if len(head.lstrip()) > SQL_START_WIDTH:
+                        is_sql = bool(SQL_START_PATTERN.match(head))
+                        unfinished = self._check_finished_words(head) if is_sql else ""
+                elif is_sql:
+                    unfinished = self._check_finished_words(unfinished + token)
+                
+                yield token
+            
+            if is_sql is None and SQL_START_PATTERN.match(head):
+                unfinished = head
+            self._reject_write_keyword(unfinished)
+        finally:
+            # Stops the generation server-side when the consumer stops early or goes away
+            await stream.close()
+    
+    def _check_finished_words(self, text: str) -> str:
+        """Reject text whose finished words include a write keyword; return the unfinished tail"""
+        end = len(text)
+        while end and (text[end - 1].isalnum() or text[end - 1] == "_"):
+            end -= 1
+        self._reject_write_keyword(text[:end])
+        return text[end:]
+    
+    def _reject_write_keyword(self, text: str):
+        """Raise if text contains a keyword the query validator would reject"""
+        keyword = self.query_validator.find_dangerous_keyword(text)
+        if keyword:
+            raise ValueError(f"Generated SQL contains a write statement ({keyword.upper()})")
+    
+    async def _with_deadline(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Run an OpenAI call under a wall-clock deadline, retrying timeouts only
+        
+        ``call`` builds a fresh awaitable per attempt. The deadline covers all of
+        it, including the client's own retries and, for streams, every chunk.
+        """
+        timeout = get_settings().OPENAI_TIMEOUT_S
+        for attempt in range(1, OPENAI_ATTEMPTS + 1):
+            try:
+                async with asyncio.timeout(timeout):
+                    return await call()
+            except (openai.APITimeoutError, TimeoutError):
+                if attempt == OPENAI_ATTEMPTS:
+                    raise
+                logger.warning("OpenAI request timed out, retrying", attempt=attempt, timeout=timeout)
+    
+    def _fingerprint_schema(self, schema_info: Dict) -> str:
+        """Get a stable digest of the schema, reusing it while the schema object is unchanged"""
+        cached_schema, fingerprint = self._schema_fingerprint
+        if cached_schema is not schema_info:
+            encoded = orjson.dumps(schema_info, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+            fingerprint = hashlib.blake2b(encoded, digest_size=16).hexdigest()
+            self._schema_fingerprint = (schema_info, fingerprint)
+        return fingerprint
+    
+    def _sql_cache_key(self, user_query: str, schema_info: Dict, history: List[Dict]) -> str:
+        """Build a cache key shared by all workers for the same model, question, schema and history"""
+        history_digest = hashlib.blake2b(orjson.dumps(history), digest_size=16).hexdigest() if history else ""
+        return (
+            f"{get_settings().OPENAI_MODEL}|{normalize_question(user_query)}|"
+            f"{self._fingerprint_schema(schema_info)}|{history_digest}"
+        )
     
     def _build_schema_context(self, schema_info: Dict) -> str:
-        """Build schema context for LLM"""
-        context = "CURRENT DATABASE SCHEMA:\n"
+        """Build schema context for LLM, rendering each distinct schema only once"""
+        fingerprint = self._fingerprint_schema(schema_info)
+        context = self._schema_contexts.get(fingerprint)
+        if context is None:
+            context = self._render_schema_context(schema_info)
+            if len(self._schema_contexts) >= SCHEMA_CONTEXT_CACHE_SIZE:
+                # Schemas only move forward, so the oldest rendering is the one to drop
+                self._schema_contexts.pop(next(iter(self._schema_contexts)))
+            self._schema_contexts[fingerprint] = context
+        return context
+    
+    def _render_schema_context(self, schema_info: Dict) -> str:
+        """Render schema information as prompt text"""
+        parts = ["CURRENT DATABASE SCHEMA:\n"]
         
         for schema_name, schema_data in schema_info.items():
-            context += f"\n{schema_name} schema:\n"
+            parts.append(f"\n{schema_name} schema:\n")
             for table_name, table_data in schema_data.get("tables", {}).items():
-                context += f"  - {table_name}: {table_data.get('description', '')}\n"
+                parts.append(f"  - {table_name}: {table_data.get('description', '')}\n")
                 columns = table_data.get("columns", {})
                 if columns:
-                    context += f"    Columns: {', '.join(columns.keys())}\n"
+                    parts.append(f"    Columns: {', '.join(columns.keys())}\n")
         
-        return context
+        return "".join(parts)
     
     async def _get_conversation_history(self, conversation_id: str) -> List[Dict]:
-        """Get conversation history for context"""
+        """Get conversation history for context, oldest message first"""
         try:
-            history_data = await get_cache(f"conversation:{conversation_id}")
-            if history_data:
-                return json.loads(history_data)
+            raw_messages = await get_list_cache(f"conv:{conversation_id}", CONVERSATION_HISTORY_LIMIT)
+            return [orjson.loads(message) for message in reversed(raw_messages)]
         except Exception as e:
             logger.warning("Failed to get conversation history", error=str(e))
         
         return []
     
-    async def _save_conversation_history(self, conversation_id: str, messages: List[Dict]):
-        """Save conversation history"""
+    async def _append_conversation_history(self, conversation_id: str, messages: List[Dict]):
+        """Append messages to conversation history"""
         try:
-            # Keep only last 5 exchanges to avoid token limits
-            if len(messages) > 10:
-                messages = messages[-10:]
-            
-            await set_cache(
-                f"conversation:{conversation_id}",
-                json.dumps(messages),
+            # Redis keeps only the last 5 exchanges to avoid token limits, so
+            # reads and writes stay bounded however long the conversation gets
+            await push_list_cache(
+                f"conv:{conversation_id}",
+                (orjson.dumps(message) for message in messages),
+                max_length=CONVERSATION_HISTORY_LIMIT,
                 expire=3600  # 1 hour
             )
         except Exception as e:
             logger.warning("Failed to save conversation history", error=str(e))
     
-    async def explain_query(self, sql_query: str) -> str:
-        """Explain what a SQL query does in natural language"""
+    async def explain_and_suggest(self, sql_query: str, user_query: str = "") -> Dict:
+        """Explain a SQL query and suggest improvements in a single call"""
         try:
-            response = await self.client.chat.completions.create(
-                model=settings.OPENAI_MODEL,
+            response = await self._with_deadline(lambda: self.client.chat.completions.create(
+                timeout=get_settings().OPENAI_TIMEOUT_S,
+                model=get_settings().OPENAI_MODEL,
+                response_format={"type": "json_object"},
                 messages=[
-                    {"role": "system", "content": "You are a SQL expert. Explain what the following SQL query does in simple, non-technical language."},
-                    {"role": "user", "content": f"Explain this SQL query: {sql_query}"}
+                    {"role": "system", "content": (
+                        "You are a SQL expert. Explain what the given SQL query does in simple, "
+                        "non-technical language and suggest 2-3 improvements for it. "
+                        'Return JSON: {"explanation": string, "suggestions": [string, ...]}'
+                    )},
+                    {"role": "user", "content": f"Original question: {user_query}\nSQL query: {sql_query}"}
                 ],
-                max_tokens=200,
-                temperature=0.3
-            )
+                max_tokens=500,
+                temperature=0.2
+            ))
             
-            return response.choices[0].message.content.strip()
+            result = orjson.loads(response.choices[0].message.content)
+            suggestions = result.get("suggestions")
+            return {
+                "explanation": str(result.get("explanation") or "Unable to explain this query."),
+                "suggestions": [str(s) for s in suggestions] if isinstance(suggestions, list) else []
+            }
             
         except Exception as e:
             logger.error("Failed to explain query", error=str(e))
-            return "Unable to explain this query."
+            return {
+                "explanation": "Unable to explain this query.",
+                "suggestions": []
+            }
+    
+    async def explain_query(self, sql_query: str) -> str:
+        """Explain what a SQL query does in natural language"""
+        return (await self.explain_and_suggest(sql_query))["explanation"]
     
     async def suggest_improvements(self, user_query: str, sql_query: str) -> List[str]:
         """Suggest improvements to the query"""
-        try:
-            response = await self.client.chat.completions.create(
-                model=settings.OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a SQL expert. Suggest 2-3 improvements for the given SQL query. Return as a JSON array of strings."},
-                    {"role": "user", "content": f"Original question: {user_query}\nSQL query: {sql_query}\nSuggest improvements:"}
-                ],
-                max_tokens=300,
-                temperature=0.2
-            )
-            
-            suggestions_text = response.choices[0].message.content.strip()
-            try:
-                suggestions = json.loads(suggestions_text)
-                return suggestions if isinstance(suggestions, list) else []
-            except json.JSONDecodeError:
-                # Fallback: split by newlines
-                return [s.strip() for s in suggestions_text.split('\n') if s.strip()]
-                
-        except Exception as e:
-            logger.error("Failed to suggest improvements", error=str(e))
-            return [] 
\ No newline at end of file
+        return (await self.explain_and_suggest(sql_query, user_query))["suggestions"] 
\ No newline at end of file
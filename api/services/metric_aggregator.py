@@ -0,0 +1,113 @@
+"""
+Metric aggregator for precomputed high-frequency answers
+"""
+
+import asyncio
+import time
+from typing import Dict, Iterable, Optional
+import structlog
+
+from api.core.config import get_settings
+from api.core.database import execute_query
+from api.services.query_validator import QueryValidator
+from api.utils.text import normalize_question
+
+logger = structlog.get_logger()
+
+class MetricAggregator:
+    """Service that keeps common aggregates precomputed in process"""
+    
+    def __init__(self, query_validator: Optional[QueryValidator] = None):
+        self.metrics: Dict[str, Dict] = {}
+        self.query_validator = query_validator or QueryValidator()
+        self._register_configured_metrics()
+    
+    def _register_configured_metrics(self):
+        """Register the aggregates listed in PRECOMPUTED_METRICS"""
+        for definition in get_settings().PRECOMPUTED_METRICS:
+            try:
+                self.register(
+                    definition["name"],
+                    definition["sql"],
+                    questions=definition["questions"],
+                    description=definition.get("description", ""),
+                    refresh_seconds=definition.get("refresh_seconds", 300)
+                )
+            except (KeyError, TypeError) as e:
+                logger.warning("Skipping malformed metric definition", definition=definition, error=str(e))
+    
+    def register(
+        self,
+        name: str,
+        sql: str,
+        questions: Iterable[str],
+        description: str = "",
+        refresh_seconds: int = 300
+    ):
+        """Register a metric answering the given questions
+        
+        Questions are matched whole after normalization, so a question that adds
+        a filter ("... last month") never gets the unfiltered figure. The SQL is
+        validated on every refresh and the metric isn't served until it passes.
+        """
+        self.metrics[name] = {
+            "sql": sql,
+            "questions": {normalize_question(q) for q in questions},
+            "description": description or name,
+            "refresh_seconds": refresh_seconds,
+            "last_value": None,
+            "last_ts": 0.0
+        }
+    
+    async def refresh(self, name: str):
+        """Recompute a single metric, dropping it if its SQL no longer validates"""
+        metric = self.metrics[name]
+        # Same checks as generated SQL, so this shortcut can't reach tables the
+        # allow-list hides from the chat path
+        validation_result = await self.query_validator.validate_query(metric["sql"])
+        if not validation_result["is_valid"]:
+            logger.warning("Metric SQL rejected", metric=name, error=validation_result["error"])
+            metric["last_value"] = None
+            metric["last_ts"] = time.monotonic()
+            return
+        
+        try:
+            metric["last_value"] = await execute_query(metric["sql"])
+            metric["last_ts"] = time.monotonic()
+        except Exception as e:
+            logger.warning("Metric refresh failed", metric=name, error=str(e))
+    
+    async def refresh_loop(self):
+        """Keep every registered metric fresh; run as a background task"""
+        while True:
+            now = time.monotonic()
+            for name, metric in self.metrics.items():
+                if now - metric["last_ts"] >= metric["refresh_seconds"]:
+                    await self.refresh(name)
+            
+            await asyncio.sleep(min((m["refresh_seconds"] for m in self.metrics.values()), default=60))
+    
+    def match(self, message: str) -> Optional[Dict]:
+        """Find a fresh precomputed metric answering the question, if any"""
+        message = normalize_question(message)
+        now = time.monotonic()
+        
+        for metric in self.metrics.values():
+            if metric["last_value"] is None:
+                continue
+            # Don't serve values the refresh loop has stopped keeping up with
+            if now - metric["last_ts"] > 2 * metric["refresh_seconds"]:
+                continue
+            if message in metric["questions"]:
+                return metric
+        
+        return None
+    
+    def format_message(self, metric: Dict) -> str:
+        """Format the chat answer for a precomputed metric"""
+        data = metric["last_value"].get("data") or [{}]
+        value = next(iter(data[0].values()), None)
+        return f"{metric['description']}: {value}"
+
+# Create global aggregator instance
+metric_aggregator = MetricAggregator()
@@ -3,13 +3,31 @@ Query validation service for SQL safety and correctness
 """
 
 import re
-from typing import Dict, List, Tuple
+import json
+import base64
+import hashlib
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+import re2
+import sqlparse
+from sqlparse import sql, tokens as T
 import structlog
 
-from api.core.config import settings
+from api.core.config import get_settings
+from api.utils.cache import get_cache_json, set_cache_json
 
 logger = structlog.get_logger()
 
+VALIDATION_CACHE_SIZE = 4096
+VALIDATION_CACHE_TTL = 3600  # seconds
+
+# The danger scan runs on untrusted input, and patterns like "OR.*1=1" go
+# quadratic under stdlib backtracking; RE2 matches in linear time
+_CASELESS = re2.Options()
+_CASELESS.case_sensitive = False
+
 class QueryValidator:
     """Service for validating SQL queries"""
     
@@ -19,8 +37,7 @@ class QueryValidator:
             "TRUNCATE", "GRANT", "REVOKE", "EXECUTE", "EXEC"
         ]
         
-        self.allowed_schemas = settings.BI_SCHEMAS
-        self.readonly_tables = settings.READONLY_TABLES
+        self._load_settings()
         
         # SQL injection patterns
         self.injection_patterns = [
@@ -33,9 +50,106 @@ class QueryValidator:
             r"AND.*1=1",
             r"AND.*'1'='1'"
         ]
+        # Every injection pattern needs one of these substrings to match, so a
+        # query containing none of them only has to be checked for keywords.
+        # Keep this in step with injection_patterns
+        self.injection_sentinels = ("';", "UNION", "=")
+        
+        # Precompiled patterns. Dangerous keywords and injection patterns share
+        # one alternation so a query is scanned once for both; the named group
+        # that matched tells them apart. Keywords only match as whole words, so
+        # identifiers such as created_at or last_update are not rejected
+        keyword_pattern = r"(?P<keyword>\b(?:" + "|".join(map(re.escape, self.dangerous_keywords)) + r")\b)"
+        self._danger_re = re2.compile(
+            keyword_pattern +
+            "|(?P<injection>" + "|".join(f"(?:{pattern})" for pattern in self.injection_patterns) + ")",
+            _CASELESS
+        )
+        self._keyword_re = re2.compile(keyword_pattern, _CASELESS)
+        self._ref_re = re.compile(
+            r'(?:FROM|JOIN)\s+(?P<table>[a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)',
+            re.IGNORECASE
+        )
+        # Everything the structural checks need, collected by _scan in one pass
+        self._scan_re = re.compile(
+            r'(?P<ref>(?:FROM|JOIN)(?:\s+(?P<table>[a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*))?)'
+            r'|(?P<limit>LIMIT(?:\s+(?P<limit_value>\d+))?)'
+            r'|(?P<select>SELECT)'
+            r'|(?P<open>\()'
+            r'|(?P<close>\))',
+            re.IGNORECASE
+        )
+        self._comment_line_re = re.compile(r'--.*$', re.MULTILINE)
+        self._comment_block_re = re.compile(r'/\*.*?\*/', re.DOTALL)
+        self._ws_re = re.compile(r'\s+')
+        
+        # Trailing single-column ORDER BY usable as a keyset pagination key
+        self.order_by_pattern = re.compile(
+            r"ORDER\s+BY\s+(?:[a-zA-Z_][a-zA-Z0-9_]*\.)?(?P<key>[a-zA-Z_][a-zA-Z0-9_]*)"
+            r"(?:\s+(?P<direction>ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?"
+            r"(?:\s+LIMIT\s+\d+)?(?:\s+OFFSET\s+\d+)?\s*;?\s*$",
+            re.IGNORECASE
+        )
+    
+    def _load_settings(self):
+        """Read the settings validation depends on and drop results computed under old ones"""
+        settings = get_settings()
+        self._settings = settings
+        self.allowed_schemas = settings.BI_SCHEMAS
+        self.readonly_tables = settings.READONLY_TABLES
+        self._max_rows = settings.MAX_RESULT_ROWS
+        self._settings_fingerprint = f"{','.join(sorted(self.readonly_tables))}|{self._max_rows}"
+        self._validation_cache: Dict[str, Dict] = {}
     
     async def validate_query(self, sql_query: str) -> Dict:
-        """Validate SQL query for safety and correctness"""
+        """Validate SQL query for safety and correctness, reusing earlier results"""
+        if get_settings() is not self._settings:
+            self._load_settings()
+        
+        result = self._validation_cache.get(sql_query)
+        if result is None:
+            result = self._validate(sql_query)
+            # Unexpected errors aren't a property of the query; don't keep them
+            if result["is_valid"] or not result["error"].startswith("Validation error"):
+                self._remember(sql_query, result)
+        
+        # Callers may append warnings; never hand out the cached lists
+        return {**result, "warnings": list(result["warnings"])}
+    
+    async def validate_query_cached(self, sql_query: str) -> Dict:
+        """Validate SQL query, sharing results across workers through Redis
+        
+        Checks the in-process cache first: a Redis round-trip costs more than
+        validating a typical query, so Redis only pays off for queries this
+        worker hasn't seen yet.
+        """
+        if get_settings() is not self._settings:
+            self._load_settings()
+        
+        if sql_query in self._validation_cache:
+            return await self.validate_query(sql_query)
+        
+        key_material = f"{self._settings_fingerprint}|{sql_query}"
+        cache_key = f"qv:{hashlib.sha1(key_material.encode()).hexdigest()}"
+        cached = await get_cache_json(cache_key)
+        if cached is not None:
+            self._remember(sql_query, cached)
+            return {**cached, "warnings": list(cached["warnings"])}
+        
+        result = await self.validate_query(sql_query)
+        if sql_query in self._validation_cache:
+            await set_cache_json(cache_key, result, expire=VALIDATION_CACHE_TTL)
+        return result
+    
+    def _remember(self, sql_query: str, result: Dict):
+        """Store a validation result, evicting the oldest when full"""
+        if len(self._validation_cache) >= VALIDATION_CACHE_SIZE:
+            # Dicts keep insertion order, so the first key is the oldest
+            self._validation_cache.pop(next(iter(self._validation_cache)))
+        self._validation_cache[sql_query] = result
+    
+    def _validate(self, sql_query: str) -> Dict:
+        """Run all validation checks on a query"""
         
         validation_result = {
             "is_valid": True,
@@ -50,37 +164,39 @@ class QueryValidator:
                 validation_result["error"] = "Query cannot be empty"
                 return validation_result
             
-            # Convert to uppercase for keyword checking
-            query_upper = sql_query.upper().strip()
+            # Convert to uppercase once for keyword checking; the helpers reuse it
+            query_upper = sql_query.upper()
             
-            # Check for dangerous operations
-            for keyword in self.dangerous_keywords:
-                if keyword in query_upper:
-                    validation_result["is_valid"] = False
-                    validation_result["error"] = f"Operation '{keyword}' is not allowed"
-                    return validation_result
-            
-            # Check for SQL injection patterns
-            for pattern in self.injection_patterns:
-                if re.search(pattern, query_upper, re.IGNORECASE):
-                    validation_result["is_valid"] = False
+            # Check for dangerous operations and SQL injection patterns; the
+            # sentinel prefilter only skips work, never a check that could match
+            if any(sentinel in query_upper for sentinel in self.injection_sentinels):
+                danger = self._danger_re.search(query_upper)
+            else:
+                danger = self._keyword_re.search(query_upper)
+            if danger:
+                validation_result["is_valid"] = False
+                if danger.group("keyword"):
+                    validation_result["error"] = f"Operation '{danger.group('keyword')}' is not allowed"
+                else:
                     validation_result["error"] = "Query contains potentially malicious patterns"
-                    return validation_result
+                return validation_result
+            
+            stats = self._scan(sql_query)
             
             # Validate schema access
-            schema_validation = self._validate_schema_access(sql_query)
+            schema_validation = self._validate_schema_access(sql_query, stats)
             if not schema_validation["is_valid"]:
                 validation_result["is_valid"] = False
                 validation_result["error"] = schema_validation["error"]
                 return validation_result
             
             # Check query structure
-            structure_validation = self._validate_query_structure(sql_query)
+            structure_validation = self._validate_query_structure(sql_query, stats, query_upper)
             if not structure_validation["is_valid"]:
                 validation_result["warnings"].append(structure_validation["error"])
             
             # Check for reasonable limits
-            limit_validation = self._validate_query_limits(sql_query)
+            limit_validation = self._validate_query_limits(sql_query, stats)
             if not limit_validation["is_valid"]:
                 validation_result["warnings"].append(limit_validation["error"])
             
@@ -93,20 +209,43 @@ class QueryValidator:
             validation_result["error"] = f"Validation error: {str(e)}"
             return validation_result
     
-    def _validate_schema_access(self, sql_query: str) -> Dict:
-        """Validate that query only accesses allowed schemas and tables"""
-        
-        # Extract table references from query
-        table_pattern = r'FROM\s+([a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)'
-        table_matches = re.findall(table_pattern, sql_query, re.IGNORECASE)
-        
-        # Also check for JOIN clauses
-        join_pattern = r'JOIN\s+([a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)'
-        join_matches = re.findall(join_pattern, sql_query, re.IGNORECASE)
+    def _scan(self, sql_query: str) -> Dict:
+        """Collect table references, LIMIT, SELECT count and parenthesis balance in one pass"""
+        stats = {
+            "tables": [],
+            "has_from": False,
+            "has_limit": False,
+            "limit_value": None,
+            "select_count": 0,
+            "paren_balance": 0
+        }
         
-        all_table_refs = table_matches + join_matches
+        for match in self._scan_re.finditer(sql_query):
+            kind = match.lastgroup
+            if kind == "ref":
+                if match.group("ref")[:4].upper() == "FROM":
+                    stats["has_from"] = True
+                if match.group("table"):
+                    stats["tables"].append(match.group("table"))
+            elif kind == "limit":
+                stats["has_limit"] = True
+                if stats["limit_value"] is None and match.group("limit_value"):
+                    stats["limit_value"] = int(match.group("limit_value"))
+            elif kind == "select":
+                stats["select_count"] += 1
+            elif kind == "open":
+                stats["paren_balance"] += 1
+            else:
+                stats["paren_balance"] -= 1
+        
+        return stats
+    
+    def _validate_schema_access(self, sql_query: str, stats: Optional[Dict] = None) -> Dict:
+        """Validate that query only accesses allowed schemas and tables"""
+        stats = stats or self._scan(sql_query)
         
-        for table_ref in all_table_refs:
+        # Check table references from FROM and JOIN clauses
+        for table_ref in stats["tables"]:
             if table_ref not in self.readonly_tables:
                 return {
                     "is_valid": False,
@@ -115,27 +254,33 @@ class QueryValidator:
         
         return {"is_valid": True, "error": None}
     
-    def _validate_query_structure(self, sql_query: str) -> Dict:
+    def _validate_query_structure(
+        self,
+        sql_query: str,
+        stats: Optional[Dict] = None,
+        query_upper: Optional[str] = None
+    ) -> Dict:
         """Validate basic SQL query structure"""
-        
-        query_upper = sql_query.upper()
+        stats = stats or self._scan(sql_query)
         
         # Must start with SELECT
-        if not query_upper.strip().startswith("SELECT"):
+        if query_upper is None:
+            query_upper = sql_query.lstrip()[:6].upper()
+        if not query_upper.lstrip().startswith("SELECT"):
             return {
                 "is_valid": False,
                 "error": "Query must be a SELECT statement"
             }
         
         # Check for basic SELECT structure
-        if "FROM" not in query_upper:
+        if not stats["has_from"]:
             return {
                 "is_valid": False,
                 "error": "Query must contain FROM clause"
             }
         
         # Check for balanced parentheses
-        if query_upper.count("(") != query_upper.count(")"):
+        if stats["paren_balance"] != 0:
             return {
                 "is_valid": False,
                 "error": "Unbalanced parentheses in query"
@@ -143,41 +288,41 @@ class QueryValidator:
         
         return {"is_valid": True, "error": None}
     
-    def _validate_query_limits(self, sql_query: str) -> Dict:
+    def _validate_query_limits(self, sql_query: str, stats: Optional[Dict] = None) -> Dict:
         """Validate query has reasonable limits"""
-        
-        query_upper = sql_query.upper()
+        stats = stats or self._scan(sql_query)
         
         # Check if query has LIMIT clause
-        if "LIMIT" not in query_upper:
+        if not stats["has_limit"]:
             return {
                 "is_valid": False,
                 "error": "Query should include LIMIT clause for large result sets"
             }
         
-        # Extract LIMIT value
-        limit_pattern = r'LIMIT\s+(\d+)'
-        limit_match = re.search(limit_pattern, query_upper)
-        
-        if limit_match:
-            limit_value = int(limit_match.group(1))
-            if limit_value > settings.MAX_RESULT_ROWS:
+        limit_value = stats["limit_value"]
+        if limit_value is not None:
+            if limit_value > self._max_rows:
                 return {
                     "is_valid": False,
-                    "error": f"LIMIT value ({limit_value}) exceeds maximum allowed ({settings.MAX_RESULT_ROWS})"
+                    "error": f"LIMIT value ({limit_value}) exceeds maximum allowed ({self._max_rows})"
                 }
         
         return {"is_valid": True, "error": None}
     
+    def find_dangerous_keyword(self, text: str) -> Optional[str]:
+        """Return the first dangerous keyword in text, matched exactly as validation does"""
+        match = self._keyword_re.search(text)
+        return match.group("keyword") if match else None
+    
     def sanitize_query(self, sql_query: str) -> str:
         """Sanitize SQL query for safe execution"""
         
         # Remove comments
-        sql_query = re.sub(r'--.*$', '', sql_query, flags=re.MULTILINE)
-        sql_query = re.sub(r'/\*.*?\*/', '', sql_query, flags=re.DOTALL)
+        sql_query = self._comment_line_re.sub('', sql_query)
+        sql_query = self._comment_block_re.sub('', sql_query)
         
         # Remove extra whitespace
-        sql_query = re.sub(r'\s+', ' ', sql_query)
+        sql_query = self._ws_re.sub(' ', sql_query)
         
         # Ensure proper termination
         sql_query = sql_query.strip()
@@ -189,36 +334,37 @@ class QueryValidator:
     def extract_table_names(self, sql_query: str) -> List[str]:
         """Extract table names from SQL query"""
         
-        table_names = []
-        
-        # FROM clause
-        from_pattern = r'FROM\s+([a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)'
-        from_matches = re.findall(from_pattern, sql_query, re.IGNORECASE)
-        table_names.extend(from_matches)
-        
-        # JOIN clauses
-        join_pattern = r'JOIN\s+([a-zA-Z_][a-zA-Z0-9_]*\.[a-zA-Z_][a-zA-Z0-9_]*)'
-        join_matches = re.findall(join_pattern, sql_query, re.IGNORECASE)
-        table_names.extend(join_matches)
-        
-        return list(set(table_names))  # Remove duplicates
+        # FROM and JOIN clauses, deduplicated as they're found
+        return list({match.group("table") for match in self._ref_re.finditer(sql_query)})
     
-    def estimate_query_complexity(self, sql_query: str) -> Dict:
-        """Estimate query complexity for monitoring"""
+    def estimate_query_complexity(
+        self,
+        sql_query: str,
+        table_names: Optional[List[str]] = None,
+        query_upper: Optional[str] = None
+    ) -> Dict:
+        """Estimate query complexity for monitoring
+        
+        Pass ``table_names`` from extract_table_names and an already upper-cased
+        ``query_upper`` to skip computing them again.
+        """
         
         complexity_score = 0
         factors = []
         
-        query_upper = sql_query.upper()
+        if query_upper is None:
+            query_upper = sql_query.upper()
         
         # Count tables
-        table_count = len(self.extract_table_names(sql_query))
+        if table_names is None:
+            table_names = self.extract_table_names(sql_query)
+        table_count = len(table_names)
         if table_count > 3:
             complexity_score += 2
             factors.append(f"Multiple table joins ({table_count} tables)")
         
         # Check for subqueries
-        if "SELECT" in query_upper and query_upper.count("SELECT") > 1:
+        if query_upper.count("SELECT") > 1:
             complexity_score += 1
             factors.append("Contains subqueries")
         
@@ -241,4 +387,119 @@ class QueryValidator:
             "factors": factors,
             "table_count": table_count,
             "is_complex": complexity_score > 3
-        } 
\ No newline at end of file
+        }
+    
+    def paginate_query(self, sql_query: str, page_size: int, cursor: Optional[str] = None) -> Optional[Dict]:
+        """Rewrite a query for keyset pagination on its ORDER BY key
+        
+        Returns None if the query isn't ordered by a single column that is also
+        one of its output columns. The key should be unique; rows sharing a key
+        value across a page boundary are skipped, as are NULL keys.
+        """
+        match = self.order_by_pattern.search(sql_query)
+        if not match:
+            return None
+        
+        sort_key = match.group("key").lower()
+        output_columns = self._output_columns(sql_query)
+        if output_columns is not None and sort_key not in output_columns:
+            # The outer page query can only order by what the base query returns
+            return None
+        descending = (match.group("direction") or "").upper() == "DESC"
+        base_query = sql_query.strip().rstrip(";")
+        query_id = self.page_query_id(base_query)
+        
+        # Positional $n arguments rather than :name binds: the generated SQL is
+        # passed through as is, so a ':word' inside one of its literals stays text
+        args = []
+        where_clause = ""
+        if cursor:
+            cursor_data = self.decode_cursor(cursor)
+            if (cursor_data["query_id"] != query_id or cursor_data["key"] != sort_key
+                    or cursor_data["descending"] != descending):
+                raise ValueError("Pagination cursor does not match this query")
+            args.append(cursor_data["value"])
+            where_clause = f"WHERE _page.{sort_key} {'<' if descending else '>'} ${len(args)}"
+        args.append(page_size + 1)  # one extra row tells us if there's a next page
+        
+        # Line breaks keep a trailing comment in the generated SQL from eating the rest
+        query = "\n".join(filter(None, [
+            f"SELECT * FROM (\n{base_query}\n) AS _page",
+            where_clause,
+            f"ORDER BY _page.{sort_key} {'DESC' if descending else 'ASC'} LIMIT ${len(args)}"
+        ]))
+        
+        return {
+            "query": query,
+            "query_id": query_id,
+            "args": args,
+            "sort_key": sort_key,
+            "descending": descending,
+            "page_size": page_size
+        }
+    
+    def page_query_id(self, sql_query: str) -> str:
+        """Digest identifying the query a cursor pages through"""
+        return hashlib.blake2b(sql_query.strip().rstrip(";").encode(), digest_size=16).hexdigest()
+    
+    def _output_columns(self, sql_query: str) -> Optional[set]:
+        """Names of the columns the outermost SELECT returns, or None if it uses a wildcard"""
+        statement = sqlparse.parse(sql_query)[0]
+        columns = set()
+        in_select_list = False
+        for token in statement.tokens:
+            if not in_select_list:
+                in_select_list = token.ttype is T.DML and token.normalized == "SELECT"
+                continue
+            if token.ttype is T.Keyword and token.normalized == "FROM":
+                break
+            items = token.get_identifiers() if isinstance(token, sql.IdentifierList) else [token]
+            for item in items:
+                if item.ttype is T.Wildcard or (isinstance(item, sql.Identifier) and item.is_wildcard()):
+                    return None
+                if isinstance(item, (sql.Identifier, sql.Function)):
+                    columns.add(item.get_name().lower())
+        return columns
+    
+    def encode_cursor(
+        self, sort_key: str, value: Any, descending: bool = False, query_id: Optional[str] = None
+    ) -> str:
+        """Serialize the last sort-key value of a page into an opaque cursor"""
+        if isinstance(value, datetime):
+            value_type, value = "datetime", value.isoformat()
+        elif isinstance(value, date):
+            value_type, value = "date", value.isoformat()
+        elif isinstance(value, Decimal):
+            value_type, value = "decimal", str(value)
+        elif isinstance(value, uuid.UUID):
+            value_type, value = "uuid", str(value)
+        elif isinstance(value, (str, int, float, bool)):
+            value_type = "raw"
+        else:
+            # NULL or a type we can't round-trip as a bind parameter
+            raise ValueError(f"Cannot paginate on a {type(value).__name__} sort key")
+        
+        payload = json.dumps({"q": query_id, "k": sort_key, "d": descending, "t": value_type, "v": value})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+    
+    def decode_cursor(self, cursor: str) -> Dict:
+        """Decode a cursor produced by encode_cursor"""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            value_type, value = payload["t"], payload["v"]
+            if value_type == "datetime":
+                value = datetime.fromisoformat(value)
+            elif value_type == "date":
+                value = date.fromisoformat(value)
+            elif value_type == "decimal":
+                value = Decimal(value)
+            elif value_type == "uuid":
+                value = uuid.UUID(value)
+            return {
+                "query_id": payload.get("q"),
+                "key": payload["k"],
+                "descending": payload["d"],
+                "value": value
+            }
+        except Exception:
+            raise ValueError("Invalid pagination cursor")
@@ -2,30 +2,72 @@
 Redis cache utilities for the chatbot
 """
 
-import json
+import time
 import asyncio
-from typing import Any, Optional
+from hashlib import blake2b
+from typing import Any, Iterable, List, Optional, Union
 from redis import asyncio as aioredis
+import orjson
 import structlog
 
-from api.core.config import settings
+from api.core.config import get_settings
 
 logger = structlog.get_logger()
 
-# Redis connection pool
-redis_pool = None
+# Redis connection pool, created at startup by init_redis
+redis_pool: Optional[aioredis.Redis] = None
 
-async def get_redis_pool():
-    """Get Redis connection pool"""
+# Cached payloads may carry non-string keys or numpy values from pandas
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+# INCRBY and start the window's TTL atomically; runs via EVALSHA once loaded
+RATE_LIMIT_SCRIPT = """
+local count = redis.call('INCRBY', KEYS[1], ARGV[2])
+if count == tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return count
+"""
+_rate_limit_script = None
+
+# INFO snapshot shared by get_cache_stats callers
+CACHE_STATS_TTL = 5  # seconds
+_stats_cache = {"timestamp": float("-inf"), "stats": {}}
+_stats_lock = asyncio.Lock()
+
+# Keys fetched per SCAN step and unlinked per call when clearing a user's cache
+CLEAR_BATCH_SIZE = 500
+
+def _key(query: str) -> str:
+    """Digest a query into a cache key component that is the same in every process"""
+    return blake2b(query.encode("utf-8"), digest_size=16).hexdigest()
+
+def init_redis() -> aioredis.Redis:
+    """Create the Redis connection pool"""
     global redis_pool
-    if redis_pool is None:
-        redis_pool = aioredis.from_url(
-            settings.REDIS_URL,
-            encoding="utf-8",
-            decode_responses=True
-        )
+    settings = get_settings()
+    redis_pool = aioredis.from_url(
+        settings.REDIS_URL,
+        encoding="utf-8",
+        decode_responses=True,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        socket_keepalive=True
+    )
     return redis_pool
 
+async def close_redis():
+    """Close the Redis connection pool"""
+    global redis_pool
+    if redis_pool is not None:
+        await redis_pool.aclose()
+        redis_pool = None
+
+async def get_redis_pool():
+    """Get Redis connection pool"""
+    # Only scripts running outside the app's lifespan get here before init_redis
+    return redis_pool or init_redis()
+
 async def get_cache(key: str) -> Optional[str]:
     """Get value from cache"""
     try:
@@ -38,7 +80,7 @@ async def get_cache(key: str) -> Optional[str]:
         logger.warning("Cache get failed", key=key, error=str(e))
         return None
 
-async def set_cache(key: str, value: str, expire: int = 3600) -> bool:
+async def set_cache(key: str, value: Union[str, bytes], expire: int = 3600) -> bool:
     """Set value in cache with expiration"""
     try:
         redis = await get_redis_pool()
@@ -65,8 +107,8 @@ async def get_cache_json(key: str) -> Optional[dict]:
     value = await get_cache(key)
     if value:
         try:
-            return json.loads(value)
-        except json.JSONDecodeError:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
             logger.warning("Invalid JSON in cache", key=key)
             return None
     return None
@@ -74,12 +116,39 @@ async def get_cache_json(key: str) -> Optional[dict]:
 async def set_cache_json(key: str, value: dict, expire: int = 3600) -> bool:
     """Set JSON value in cache"""
     try:
-        json_value = json.dumps(value)
+        json_value = orjson.dumps(value, option=JSON_OPTIONS)
         return await set_cache(key, json_value, expire)
     except Exception as e:
         logger.warning("Cache JSON set failed", key=key, error=str(e))
         return False
 
+async def push_list_cache(key: str, values: Iterable[Union[str, bytes]], max_length: int, expire: int = 3600) -> bool:
+    """Prepend values to a capped list, newest first"""
+    values = list(values)
+    if not values:
+        return True
+    try:
+        redis = await get_redis_pool()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(key, *values)
+            pipe.ltrim(key, 0, max_length - 1)
+            pipe.expire(key, expire)
+            await pipe.execute()
+        logger.debug("Cache list pushed", key=key, count=len(values))
+        return True
+    except Exception as e:
+        logger.warning("Cache list push failed", key=key, error=str(e))
+        return False
+
+async def get_list_cache(key: str, count: int) -> List[str]:
+    """Get up to count newest values from a capped list"""
+    try:
+        redis = await get_redis_pool()
+        return await redis.lrange(key, 0, count - 1)
+    except Exception as e:
+        logger.warning("Cache list get failed", key=key, error=str(e))
+        return []
+
 async def cache_query_result(query_hash: str, result: dict, expire: int = 1800) -> bool:
     """Cache query result"""
     return await set_cache_json(f"query_result:{query_hash}", result, expire)
@@ -90,20 +159,30 @@ async def get_cached_query_result(query_hash: str) -> Optional[dict]:
 
 async def cache_sql_generation(query: str, sql: str, expire: int = 3600) -> bool:
     """Cache SQL generation result"""
-    return await set_cache(f"sql_gen:{hash(query)}", sql, expire)
+    return await set_cache(f"sql_gen:{_key(query)}", sql, expire)
 
 async def get_cached_sql_generation(query: str) -> Optional[str]:
     """Get cached SQL generation result"""
-    return await get_cache(f"sql_gen:{hash(query)}")
+    return await get_cache(f"sql_gen:{_key(query)}")
+
+async def cache_page_query(query_id: str, sql: str, expire: int = 3600) -> bool:
+    """Cache the SQL a pagination cursor pages through"""
+    return await set_cache(f"page_sql:{query_id}", sql, expire)
 
-async def increment_rate_limit(user_id: str) -> int:
+async def get_cached_page_query(query_id: str) -> Optional[str]:
+    """Get the SQL a pagination cursor pages through"""
+    return await get_cache(f"page_sql:{query_id}")
+
+async def increment_rate_limit(user_id: str, amount: int = 1) -> int:
     """Increment rate limit counter for user"""
     try:
+        global _rate_limit_script
         redis = await get_redis_pool()
+        if _rate_limit_script is None:
+            _rate_limit_script = redis.register_script(RATE_LIMIT_SCRIPT)
         key = f"rate_limit:{user_id}"
-        count = await redis.incr(key)
-        await redis.expire(key, 60)  # Reset after 60 seconds
-        return count
+        # One round-trip; resets 60 seconds after the window's first request
+        return await _rate_limit_script(keys=[key], args=[60, amount])
     except Exception as e:
         logger.warning("Rate limit increment failed", user_id=user_id, error=str(e))
         return 0
@@ -124,27 +203,53 @@ async def clear_user_cache(user_id: str) -> bool:
     try:
         redis = await get_redis_pool()
         pattern = f"*:{user_id}"
-        keys = await redis.keys(pattern)
-        if keys:
-            await redis.delete(*keys)
-        logger.info("User cache cleared", user_id=user_id, keys_count=len(keys))
+        # SCAN walks the keyspace incrementally instead of blocking Redis like
+        # KEYS does; UNLINK frees the values off the main thread
+        keys_count = 0
+        batch = []
+        async for key in redis.scan_iter(match=pattern, count=CLEAR_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) >= CLEAR_BATCH_SIZE:
+                await redis.unlink(*batch)
+                keys_count += len(batch)
+                batch = []
+        if batch:
+            await redis.unlink(*batch)
+            keys_count += len(batch)
+        logger.info("User cache cleared", user_id=user_id, keys_count=keys_count)
         return True
     except Exception as e:
         logger.warning("User cache clear failed", user_id=user_id, error=str(e))
         return False
 
 async def get_cache_stats() -> dict:
-    """Get cache statistics"""
-    try:
-        redis = await get_redis_pool()
-        info = await redis.info()
-        return {
-            "connected_clients": info.get("connected_clients", 0),
-            "used_memory_human": info.get("used_memory_human", "0B"),
-            "total_commands_processed": info.get("total_commands_processed", 0),
-            "keyspace_hits": info.get("keyspace_hits", 0),
-            "keyspace_misses": info.get("keyspace_misses", 0)
+    """Get cache statistics, refreshed at most every few seconds"""
+    if time.monotonic() - _stats_cache["timestamp"] < CACHE_STATS_TTL:
+        return _stats_cache["stats"]
+    
+    async with _stats_lock:
+        # Another caller may have refreshed while we waited
+        if time.monotonic() - _stats_cache["timestamp"] < CACHE_STATS_TTL:
+            return _stats_cache["stats"]
+        
+        try:
+            redis = await get_redis_pool()
+            # Only the sections we report, in one round-trip
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.info("clients")
+                pipe.info("memory")
+                pipe.info("stats")
+                clients, memory, stats = await pipe.execute()
+        except Exception as e:
+            logger.warning("Cache stats failed", error=str(e))
+            return {}
+        
+        _stats_cache["stats"] = {
+            "connected_clients": clients.get("connected_clients", 0),
+            "used_memory_human": memory.get("used_memory_human", "0B"),
+            "total_commands_processed": stats.get("total_commands_processed", 0),
+            "keyspace_hits": stats.get("keyspace_hits", 0),
+            "keyspace_misses": stats.get("keyspace_misses", 0)
         }
-    except Exception as e:
-        logger.warning("Cache stats failed", error=str(e))
-        return {} 
\ No newline at end of file
+        _stats_cache["timestamp"] = time.monotonic()
+        return _stats_cache["stats"] 
\ No newline at end of file
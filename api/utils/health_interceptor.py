@@ -0,0 +1,49 @@
+"""
+ASGI interceptor answering static health probes before the FastAPI stack
+"""
+
+import orjson
+
+_JSON_HEADERS = [(b"content-type", b"application/json"), (b"allow", b"GET, HEAD")]
+
+# Probe paths, without trailing slash, and their static responses; readiness
+# stays in the router because it has to check the database
+HEALTH_RESPONSES = {
+    "/api/v1/health": orjson.dumps({
+        "status": "healthy",
+        "service": "BI Self-Service Chatbot",
+        "version": "1.0.0"
+    }),
+    "/api/v1/health/live": orjson.dumps({"status": "alive"})
+}
+
+_METHOD_NOT_ALLOWED = orjson.dumps({"detail": "Method Not Allowed"})
+
+class HealthCheckInterceptor:
+    """Answer liveness probes without routing, middleware or logging"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        # The router used to redirect "/api/v1/health" to the slashed path; answer both
+        body = HEALTH_RESPONSES.get(scope["path"].rstrip("/")) if scope["type"] == "http" else None
+        if body is None:
+            await self.app(scope, receive, send)
+            return
+        
+        method = scope["method"]
+        if method in ("GET", "HEAD"):
+            status = 200
+        else:
+            status, body = 405, _METHOD_NOT_ALLOWED
+        
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": _JSON_HEADERS + [(b"content-length", str(len(body)).encode())]
+        })
+        await send({
+            "type": "http.response.body",
+            "body": b"" if method == "HEAD" else body
+        }) 
\ No newline at end of file
@@ -5,9 +5,16 @@ Structured logging configuration for the chatbot
 import sys
 import logging
 from typing import Any, Dict
+import orjson
 import structlog
 from structlog.stdlib import LoggerFactory
 
+from api.core.config import get_settings
+
+def _serialize(event_dict: Dict[str, Any], **kwargs) -> str:
+    """Serialize a log event with orjson, keeping structlog's fallback for odd values"""
+    return orjson.dumps(event_dict, default=kwargs.get("default"), option=orjson.OPT_NON_STR_KEYS).decode()
+
 def setup_logging():
     """Setup structured logging configuration"""
     
@@ -22,7 +29,7 @@ def setup_logging():
             structlog.processors.StackInfoRenderer(),
             structlog.processors.format_exc_info,
             structlog.processors.UnicodeDecoder(),
-            structlog.processors.JSONRenderer()
+            structlog.processors.JSONRenderer(serializer=_serialize)
         ],
         context_class=dict,
         logger_factory=LoggerFactory(),
@@ -34,7 +41,7 @@ def setup_logging():
     logging.basicConfig(
         format="%(message)s",
         stream=sys.stdout,
-        level=getattr(logging, "INFO", logging.INFO)
+        level=getattr(logging, get_settings().LOG_LEVEL.upper(), logging.INFO)
     )
 
 class ChatbotLogger:
@@ -2,20 +2,77 @@
 Rate limiting utilities for the chatbot API
 """
 
+import os
+import time
 import asyncio
+from collections import defaultdict, deque
 from typing import Dict
 import structlog
 
-from api.core.config import settings
+from api.core.config import get_settings
 from api.utils.cache import increment_rate_limit, get_rate_limit_count
 
 logger = structlog.get_logger()
 
+RATE_LIMIT_WINDOW = 60  # seconds
+
+# Share of the limit the workers may grant between them without asking Redis;
+# each worker gets an equal slice and reports it on its next Redis call
+LOCAL_RATE_LIMIT_SHARE = 0.5
+_workers = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# Per-process sliding windows: every request seen, and those not yet counted in Redis
+_local_hits: Dict[str, deque] = defaultdict(deque)
+_unreported: Dict[str, deque] = defaultdict(deque)
+_last_sweep = 0.0
+
+def _prune(window: deque, cutoff: float):
+    """Drop timestamps that have left the window"""
+    while window and window[0] <= cutoff:
+        window.popleft()
+
+def _sweep(cutoff: float):
+    """Forget users with no requests left in the window"""
+    for user_id in list(_local_hits):
+        _prune(_local_hits[user_id], cutoff)
+        if not _local_hits[user_id]:
+            del _local_hits[user_id]
+            _unreported.pop(user_id, None)
+
 async def check_rate_limit(user_id: str) -> bool:
     """Check if user has exceeded rate limit"""
+    global _last_sweep
     try:
-        current_count = await increment_rate_limit(user_id)
-        limit = settings.RATE_LIMIT_PER_MINUTE
+        limit = get_settings().RATE_LIMIT_PER_MINUTE
+        now = time.monotonic()
+        cutoff = now - RATE_LIMIT_WINDOW
+        if now - _last_sweep >= RATE_LIMIT_WINDOW:
+            _sweep(cutoff)
+            _last_sweep = now
+        
+        hits = _local_hits[user_id]
+        unreported = _unreported[user_id]
+        _prune(hits, cutoff)
+        _prune(unreported, cutoff)
+        hits.append(now)
+        
+        # This process alone has seen too many requests; no need to ask Redis
+        if len(hits) > limit:
+            logger.warning("Rate limit exceeded", user_id=user_id, count=len(hits), limit=limit)
+            return False
+        
+        # Well under this worker's slice of the limit
+        if len(hits) < limit * LOCAL_RATE_LIMIT_SHARE / _workers:
+            unreported.append(now)
+            return True
+        
+        current_count = await increment_rate_limit(user_id, len(unreported) + 1)
+        if current_count:
+            unreported.clear()
+        else:
+            # Redis is unavailable (the increment reports 0): keep this request
+            # with the others so the next successful call still counts them
+            unreported.append(now)
         
         if current_count > limit:
             logger.warning("Rate limit exceeded", user_id=user_id, count=current_count, limit=limit)
@@ -31,8 +88,8 @@ async def check_rate_limit(user_id: str) -> bool:
 async def get_user_rate_limit_status(user_id: str) -> Dict:
     """Get current rate limit status for user"""
     try:
-        current_count = await get_rate_limit_count(user_id)
-        limit = settings.RATE_LIMIT_PER_MINUTE
+        current_count = await get_rate_limit_count(user_id) + len(_unreported.get(user_id, ()))
+        limit = get_settings().RATE_LIMIT_PER_MINUTE
         
         return {
             "user_id": user_id,
@@ -47,8 +104,8 @@ async def get_user_rate_limit_status(user_id: str) -> Dict:
         return {
             "user_id": user_id,
             "current_count": 0,
-            "limit": settings.RATE_LIMIT_PER_MINUTE,
-            "remaining": settings.RATE_LIMIT_PER_MINUTE,
+            "limit": get_settings().RATE_LIMIT_PER_MINUTE,
+            "remaining": get_settings().RATE_LIMIT_PER_MINUTE,
             "exceeded": False
         }
 
@@ -56,7 +113,7 @@ class RateLimitMiddleware:
     """Middleware for rate limiting requests"""
     
     def __init__(self, rate_limit_per_minute: int = None):
-        self.rate_limit = rate_limit_per_minute or settings.RATE_LIMIT_PER_MINUTE
+        self.rate_limit = rate_limit_per_minute or get_settings().RATE_LIMIT_PER_MINUTE
     
     async def __call__(self, request, call_next):
         # Extract user ID from request (implement based on your auth system)
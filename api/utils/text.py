@@ -0,0 +1,11 @@
+"""
+Text helpers shared across the chatbot
+"""
+
+def normalize_question(message: str) -> str:
+    """Lower-case a question, collapse whitespace and drop trailing ?!. marks
+    
+    Punctuation inside the question is kept: operators, signs and decimal
+    points change its meaning ("> 100" vs "< 100", "1.5" vs "15").
+    """
+    return " ".join(message.lower().rstrip("?!. \t\r\n").split())  
\ No newline at end of file
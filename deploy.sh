@@ -97,7 +97,7 @@ sleep 10
 print_status "Checking service health..."
 
 # Check API health
-if curl -f http://localhost:8000/health > /dev/null 2>&1; then
+if curl -f http://localhost:8000/api/v1/health/live > /dev/null 2>&1; then
     print_status "✅ API service is healthy"
 else
     print_warning "⚠️  API service health check failed"
@@ -122,7 +122,7 @@ echo ""
 echo "📋 Service URLs:"
 echo "   Web Interface: http://localhost:8080"
 echo "   API Documentation: http://localhost:8000/docs"
-echo "   Health Check: http://localhost:8000/health"
+echo "   Health Check: http://localhost:8000/api/v1/health/"
 echo ""
 echo "🔧 Next steps:"
 echo "   1. Access the web interface at http://localhost:8080"
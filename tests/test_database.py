@@ -0,0 +1,25 @@
+"""
+Tests for query preparation in the database module
+"""
+
+import pytest
+
+from api.core.database import _prepare_query
+
+def test_limit_survives_trailing_line_comment():
+    """A trailing -- comment must not swallow the appended LIMIT"""
+    assert _prepare_query("SELECT * FROM a.b -- note", limit=100) == "SELECT * FROM a.b LIMIT 100"
+
+def test_comment_markers_inside_literals_are_kept():
+    """Only real comments are stripped, not look-alikes inside string literals"""
+    query = _prepare_query("SELECT * FROM a.b WHERE c = '-- x' -- note", limit=10)
+    assert query.endswith("WHERE c = '-- x' LIMIT 10")
+
+def test_existing_limit_is_kept():
+    """Queries that already have a LIMIT keep it"""
+    assert _prepare_query("SELECT * FROM a.b LIMIT 5; -- note", limit=100) == "SELECT * FROM a.b LIMIT 5"
+
+def test_write_statements_are_rejected():
+    """Only SELECT queries are allowed"""
+    with pytest.raises(ValueError):
+        _prepare_query("DELETE FROM a.b -- note", limit=100) 
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""
+Tests for keyset pagination in the query validator
+"""
+
+import uuid
+
+import pytest
+
+from api.services.query_validator import QueryValidator
+
+validator = QueryValidator()
+
+def test_single_output_column_key_is_paginated():
+    """A trailing ORDER BY on a selected column becomes a keyset page query"""
+    page = validator.paginate_query("SELECT id, name FROM bi_reports.users ORDER BY id DESC", 10)
+    assert page["sort_key"] == "id"
+    assert page["descending"] is True
+    assert page["args"] == [11]
+
+def test_key_missing_from_select_list_falls_back():
+    """The page query can't order by a column the base query doesn't return"""
+    assert validator.paginate_query("SELECT name FROM bi_reports.users ORDER BY created_at", 10) is None
+
+def test_wildcard_select_is_paginated():
+    """A * select list may contain the key, so the query is paginated"""
+    assert validator.paginate_query("SELECT * FROM bi_reports.users ORDER BY id", 10) is not None
+
+def test_multi_key_order_by_falls_back():
+    """An ORDER BY on several columns can't be resumed from a single key"""
+    assert validator.paginate_query("SELECT id, name FROM bi_reports.users ORDER BY name, id", 10) is None
+
+def test_uuid_cursor_round_trips():
+    """UUID keys are encoded as text and decoded back to UUIDs"""
+    sql_query = "SELECT id FROM bi_reports.users ORDER BY id"
+    value = uuid.uuid4()
+    cursor = validator.encode_cursor("id", value, query_id=validator.page_query_id(sql_query))
+    page = validator.paginate_query(sql_query, 10, cursor)
+    assert page["args"] == [value, 11]
+
+def test_null_key_cannot_be_encoded():
+    """A cursor must not be silently dropped when the last key is NULL"""
+    with pytest.raises(ValueError):
+        validator.encode_cursor("id", None)
+def test_cursor_records_its_query():
+    """Cursors carry the digest the first page's SQL is stored under"""
+    sql_query = "SELECT id FROM bi_reports.users ORDER BY id"
+    page = validator.paginate_query(sql_query, 10)
+    cursor = validator.encode_cursor("id", 5, query_id=page["query_id"])
+    assert validator.decode_cursor(cursor)["query_id"] == validator.page_query_id(sql_query)
+
+def test_cursor_from_another_query_is_rejected():
+    """A cursor can only resume the query it was issued for"""
+    page = validator.paginate_query("SELECT id FROM bi_reports.users ORDER BY id", 10)
+    cursor = validator.encode_cursor("id", 5, query_id=page["query_id"])
+    with pytest.raises(ValueError):
+        validator.paginate_query("SELECT id, name FROM bi_reports.users ORDER BY id", 10, cursor) 
\ No newline at end of file
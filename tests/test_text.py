@@ -0,0 +1,25 @@
+"""
+Tests for question normalization and the SQL cache key built from it
+"""
+
+from api.services.llm_service import LLMService
+from api.utils.text import normalize_question
+
+def test_normalize_ignores_case_spacing_and_trailing_marks():
+    """Trivially different spellings normalize the same"""
+    assert normalize_question("  Revenue   last MONTH?! ") == "revenue last month"
+
+def test_normalize_keeps_operators_signs_and_decimals():
+    """Punctuation that changes a question's meaning survives"""
+    assert normalize_question("revenue > 100") != normalize_question("revenue < 100")
+    assert normalize_question("growth -5%") != normalize_question("growth 5%")
+    assert normalize_question("ratio 1.5") != normalize_question("ratio 1 5")
+
+def test_sql_cache_key_differs_for_comparison_direction():
+    """Questions differing only in > and < never share cached SQL"""
+    service = LLMService()
+    schema = {"bi_reports": {"tables": {}}}
+    assert (
+        service._sql_cache_key("revenue > 100", schema, [])
+        != service._sql_cache_key("revenue < 100", schema, [])
+    ) 
\ No newline at end of file